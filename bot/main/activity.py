@@ -0,0 +1,172 @@
+"""Index of when each server member was last active.
+
+Activity is recorded in memory from gateway events (messages, edits and reactions)
+and periodically written to the database so it survives restarts.
+"""
+import asyncio
+import datetime
+import logging
+
+from main import database
+from main.logger import Logger
+from main.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityIndex():
+    """Keeps track of the last time each member was seen active in a server.
+
+    A server's index can only answer for a given time boundary if activity has been tracked
+    since at least that boundary (see `covers`). Tracking starts either when the bot comes
+    online in the server or from the boundary of a history scan used to backfill it.
+
+    Activity that happens while the bot is offline (or that wasn't saved before it stopped)
+    isn't recorded, so coverage saved by an earlier run only counts again once the gap since
+    it was last saved has been backfilled (see `previous_coverage`).
+
+    Attributes:
+        flush_interval (int): Seconds between writes of recorded activity to the database.
+
+    """
+    def __init__(self, flush_interval=60):
+        self.flush_interval = flush_interval
+        self._last_seen = {}  # {guild_id: {member_id: datetime}}
+        self._tracked_since = {}  # {guild_id: datetime}
+        self._previous_coverage = {}  # {guild_id: (tracked_since, tracked_until)} from an earlier run
+        self._pending_activity = {}  # {(guild_id, member_id): datetime}
+        self._loaded = set()
+        self._flush_task = None
+
+    def record(self, guild_id: int, member_id: int, when=None):
+        """Marks a member as active at a given time.
+
+        Args:
+            guild_id(int): Server's unique ID
+            member_id(int): Member's unique ID
+            when(datetime.datetime): UTC time of the activity (defaults to now).
+
+        """
+        when = when or datetime.datetime.utcnow()
+        guild_activity = self._last_seen.setdefault(guild_id, {})
+        last_seen = guild_activity.get(member_id)
+        if last_seen is None or when > last_seen:
+            guild_activity[member_id] = when
+            self._pending_activity[(guild_id, member_id)] = when
+
+    def merge(self, guild_id: int, activity: dict):
+        """Records a collection of activity {member_id: last_seen} (e.g. from a history scan)."""
+        for member_id, when in activity.items():
+            self.record(guild_id, member_id, when)
+
+    def mark_tracked(self, guild_id: int, since):
+        """Notes that a server's activity has been fully recorded since a given UTC time."""
+        tracked_since = self._tracked_since.get(guild_id)
+        if tracked_since is None or since < tracked_since:
+            self._tracked_since[guild_id] = since
+
+    def interrupt(self, guild_id: int, disconnected_at, now):
+        """Restarts a server's tracking from now after activity may have been missed since disconnected_at
+        (e.g. when the bot reconnects without resuming its session).
+
+        The tracking before the gap is kept as previous coverage, so it counts again once the gap is
+        backfilled (an earlier gap still waiting to be backfilled is kept instead, as backfilling it
+        covers this one too).
+        """
+        tracked_since = self._tracked_since.get(guild_id)
+        if tracked_since is not None and disconnected_at and guild_id not in self._previous_coverage:
+            self._previous_coverage[guild_id] = (tracked_since, disconnected_at)
+        self._tracked_since[guild_id] = now
+
+    def tracked_since(self, guild_id: int):
+        """Returns the UTC time since which a server's activity has been tracked (None if untracked)."""
+        return self._tracked_since.get(guild_id)
+
+    def previous_coverage(self, guild_id: int):
+        """Returns the span (tracked_since, tracked_until) of an earlier run's tracking that hasn't been
+        restored yet (None if there isn't one).
+
+        Activity after tracked_until may be missing until the history since then is backfilled.
+        """
+        return self._previous_coverage.get(guild_id)
+
+    def discard_previous_coverage(self, guild_id: int):
+        """Forgets an earlier run's tracking (e.g. once the gap after it has been backfilled)."""
+        self._previous_coverage.pop(guild_id, None)
+
+    def covers(self, guild_id: int, time_boundary) -> bool:
+        """Returns True if the index has a full record of a server's activity after time_boundary."""
+        tracked_since = self._tracked_since.get(guild_id)
+        return tracked_since is not None and tracked_since <= time_boundary
+
+    def last_seen(self, guild_id: int) -> dict:
+        """Returns the last activity of a server's members {member_id: last_seen}."""
+        return self._last_seen.get(guild_id, {})
+
+    async def load(self, guild_id: int):
+        """Loads a server's saved activity from the database (only done once per server)."""
+        if guild_id in self._loaded:
+            return
+
+        loop = asyncio.get_event_loop()
+        activity = await loop.run_in_executor(None, database.get_member_activity, guild_id)
+        tracked_since, tracked_until = await loop.run_in_executor(None, database.get_activity_coverage, guild_id)
+        self._loaded.add(guild_id)
+
+        # Activity recorded before loading is newer than what's saved, so keep whichever is latest
+        guild_activity = self._last_seen.setdefault(guild_id, {})
+        for member_id, when in activity.items():
+            last_seen = guild_activity.get(member_id)
+            if last_seen is None or when > last_seen:
+                guild_activity[member_id] = when
+
+        # Activity between the last save and now (e.g. while the bot was offline) may be missing,
+        # so the saved coverage can't be used until that gap is backfilled
+        if tracked_since and tracked_until:
+            self._previous_coverage[guild_id] = (tracked_since, tracked_until)
+
+    async def flush(self):
+        """Writes recorded activity to the database, along with how long each server has been tracked."""
+        flushed_at = datetime.datetime.utcnow()
+        loop = asyncio.get_event_loop()
+        activity, self._pending_activity = self._pending_activity, {}
+
+        if activity:
+            records = [(g, m, when) for (g, m), when in activity.items()]
+            try:
+                saved = await loop.run_in_executor(None, database.update_member_activity, records)
+            except Exception as e:
+                # e.g. no database connection available
+                Logger.error(logger, f"Failed to save member activity: {e}")
+                saved = False
+            if not saved:
+                Logger.warn(logger, f"Couldn't save activity of {len(records)} members. Retrying on next flush.")
+                # Anything recorded since is newer, so only re-queue what hasn't been replaced
+                for key, when in activity.items():
+                    self._pending_activity.setdefault(key, when)
+                # Coverage can't be extended past activity that wasn't saved
+                return
+
+        coverage = [
+            (guild_id, since, flushed_at) for guild_id, since in self._tracked_since.items() if guild_id in self._loaded
+        ]
+        if coverage:
+            saved = await loop.run_in_executor(None, database.update_activity_coverage, coverage)
+            if not saved:
+                Logger.warn(logger, f"Couldn't save activity coverage of {len(coverage)} servers.")
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                Logger.error(logger, f"Failed to flush member activity: {e}")
+
+    def start(self, loop):
+        """Starts periodically writing recorded activity to the database."""
+        if not self._flush_task:
+            self._flush_task = loop.create_task(self._flush_periodically())
+
+
+activity_index = ActivityIndex(flush_interval=Settings.app_defaults("activity_flush_interval") or 60)
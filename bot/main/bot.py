@@ -1,123 +1,167 @@
 # -*- coding: utf-8 -*-
 import datetime
 import logging
-import re
+import time
 import discord
+import discord.ext.commands
 import yaml
 from pathlib import Path
 
 from main import commands
 from main import utils
-#from main import database
-from main.logger import Logger
-from main.settings import Settings
+from main.activity import activity_index
+from main import database
+from main.logger import Logger, QueueLogging
+from main.member_features import role_milestones
+from main.message_features import message_handlers
+from main.settings import Settings, check_command_names
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 class Bot(discord.ext.commands.Bot):
     def run(self):
-        #database.setup()
+        self.started_at = time.perf_counter()
+        self.database_ready = False
+        self.disconnected_at = None
 
         events = [
             self.on_ready,
+            self.on_disconnect,
+            self.on_resumed,
             self.on_message,
             self.on_message_edit,
-            self.on_member_update
+            self.on_raw_reaction_add,
+            self.on_member_update,
+            self.on_guild_channel_create,
+            self.on_guild_channel_update,
+            self.on_guild_channel_delete,
+            self.on_guild_remove
         ]
         self.set_events(*events)
         self.set_commands()
+        Logger.info(logger, f"Set up in {time.perf_counter() - self.started_at:.2f}s. Connecting...")
         super(Bot, self).run(Settings.config["env"]["client_token"], reconnect=True)
 
     # --- Events ---
     async def on_ready(self):
-        Logger.info(logger, f"{self.user.name} (ID: {self.user.id}) is now online.")
+        Logger.info(
+            logger,
+            f"{self.user.name} (ID: {self.user.id}) is now online ({time.perf_counter() - self.started_at:.2f}s after start)."
+        )
+
+        # Connecting to the database is left until now so it doesn't hold up logging in
+        if not self.database_ready:
+            await self.loop.run_in_executor(None, database.setup)
+            self.database_ready = True
+
+        # Activity is tracked from here on (unless already tracked since earlier). Events missed while
+        # disconnected aren't replayed unless the session was resumed, so tracking restarts after a gap
+        now = datetime.datetime.utcnow()
+        for guild in self.guilds:
+            await activity_index.load(guild.id)
+            if self.disconnected_at:
+                activity_index.interrupt(guild.id, self.disconnected_at, now)
+            else:
+                activity_index.mark_tracked(guild.id, now)
+        self.disconnected_at = None
+        activity_index.start(self.loop)
 
-    async def on_message(self, message):
-        async def check_content(message, check, custom_message):
-            if check:
-                content = message.clean_content
-                try:
-                    await message.delete()
-                except (discord.Forbidden, discord.HTTPException) as e:
-                    Logger.warn(logger, f"Unable to delete message at {message.jump_url}. {e}")
-                else:
-                    await utils.say(message.author, context=message, parse=True, content=f"{custom_message}\nYour message: ```{content}```")
-                    return True
+    async def on_disconnect(self):
+        if not self.disconnected_at:
+            self.disconnected_at = datetime.datetime.utcnow()
 
-            return False
+    async def on_resumed(self):
+        # Events missed while disconnected are replayed on resuming
+        self.disconnected_at = None
 
+    async def on_message(self, message):
         user = message.author
         if message.guild:
-            Logger.info(logger, f"({message.guild.name} - {message.channel.name}) {user.name}: {message.content}")
+            Logger.info(
+                logger, lambda: f"({message.guild.name} - {message.channel.name}) {user.name}: {message.content}",
+                sampled=True
+            )
         else:
             try:
-                Logger.info(logger, f"({message.channel.name}) {user.name}: {message.content}")
+                Logger.info(logger, lambda: f"({message.channel.name}) {user.name}: {message.content}", sampled=True)
             except AttributeError:
-                Logger.info(logger, f"({user.name}) {message.content}")
+                Logger.info(logger, lambda: f"({user.name}) {message.content}", sampled=True)
             finally:
                 return
 
-        mee6_level_up = Settings.on_message_features(message.guild.id, "mee6_level_up")
-        if mee6_level_up and mee6_level_up.get("enabled") and user.id == mee6_level_up["bot_id"]:
-            result = re.compile(r"{}".format(mee6_level_up["message_pattern"])).search(message.content)
-            if result:
-                mentioned = message.mentions[0]
-                level = int(result.group(1))
-                Logger.info(logger, f"{mentioned.name} reached level {level}")
-
-                roles = mee6_level_up["roles"]
-                for r in roles:
-                    if level >= r:
-                        role = discord.utils.get(message.guild.roles, id=roles[r]["id"])
-                        await mentioned.add_roles(role, reason=f"User reached level {r}")
-        
-        pics_only = Settings.on_message_features(message.guild.id, "pics_only")
-        if pics_only and pics_only.get("enabled"):
-            channel = message.channel
-
-            if channel.id in pics_only["channels"]:
-                if await check_content(
-                    message,
-                    not message.attachments,
-                    pics_only["channels"][channel.id]["message"]
-                ):
-                    return
+        activity_index.record(message.guild.id, user.id, message.created_at)
+
+        server_config = await Settings.load_server_config(message.guild.id)
+        handlers = message_handlers.get(message.guild.id, server_config)
+        if handlers.handlers and await handlers.handle(message):
+            return
 
         await self.process_commands(message)
 
     async def on_message_edit(self, before, after):
         def log_message(message, content):
+            """Logs a change to a message (content is a callable returning the description)."""
             if message.guild:
-                Logger.info(logger, f"({message.guild.name} - {message.channel.name}){content}")
+                Logger.info(logger, lambda: f"({message.guild.name} - {message.channel.name}){content()}", sampled=True)
             else:
                 try:
-                    Logger.info(logger, f"({message.channel.name}){content}")
+                    Logger.info(logger, lambda: f"({message.channel.name}){content()}", sampled=True)
                 except AttributeError:
-                    Logger.info(logger, f"({message.author.name}){content}")
+                    Logger.info(logger, lambda: f"({message.author.name}){content()}", sampled=True)
 
         if before.pinned and not after.pinned:
-            log_message(after, f"<Unpinned> {after.author.display_name}: {after.content}")
+            log_message(after, lambda: f"<Unpinned> {after.author.display_name}: {after.content}")
         elif not before.pinned and after.pinned:
-            log_message(after, f"<Pinned> {after.author.display_name}: {after.content}")
+            log_message(after, lambda: f"<Pinned> {after.author.display_name}: {after.content}")
 
         if before.content != after.content:
-            log_message(after, f"<Old message> {after.author.display_name}: {before.content}")
-            log_message(after, f"<Edited> {after.author.display_name}: {after.content}")
+            log_message(after, lambda: f"<Old message> {after.author.display_name}: {before.content}")
+            log_message(after, lambda: f"<Edited> {after.author.display_name}: {after.content}")
+
+            if after.guild:
+                activity_index.record(after.guild.id, after.author.id, after.edited_at)
+
+    async def on_raw_reaction_add(self, payload):
+        if payload.guild_id:
+            activity_index.record(payload.guild_id, payload.user_id)
     
     async def on_member_update(self, before, after):
-        milestones = Settings.on_member_update_features(after.guild.id, "role_message")
-        if not milestones or not milestones.get("enabled"):
+        # Most updates are nickname, status, etc. changes, so check for new roles before anything else
+        added_role_ids = {r.id for r in after.roles}.difference(r.id for r in before.roles)
+        if not added_role_ids:
             return
 
-        before_roles = [r.id for r in before.roles]
-        after_roles = [r.id for r in after.roles]
-        for role in milestones["roles"]:
-            if role in after_roles and role not in before_roles:
-                output_channel = discord.utils.get(after.guild.channels, name=milestones["roles"][role]["channel"])
-                await utils.say(output_channel, context=after, parse=True, content=milestones["roles"][role]["message"])
-            
-        return
+        server_config = await Settings.load_server_config(after.guild.id)
+        milestones = role_milestones.get(after.guild, server_config)
+        if milestones.milestones:
+            await milestones.announce(after, added_role_ids)
+
+    async def on_guild_channel_create(self, channel):
+        utils.channel_names.invalidate(channel.guild.id)
+        role_milestones.invalidate(channel.guild.id)
+
+    async def on_guild_channel_update(self, before, after):
+        if before.name != after.name:
+            utils.channel_names.invalidate(after.guild.id)
+            role_milestones.invalidate(after.guild.id)
+
+    async def on_guild_channel_delete(self, channel):
+        utils.channel_names.invalidate(channel.guild.id)
+        role_milestones.invalidate(channel.guild.id)
+
+    async def on_guild_remove(self, guild):
+        message_handlers.invalidate(guild.id)
+        role_milestones.invalidate(guild.id)
+
+    async def close(self):
+        try:
+            await activity_index.flush()
+        except Exception as e:
+            Logger.error(logger, f"Failed to save member activity before closing: {e}")
+        await super(Bot, self).close()
+        Logger.info(logger, f"Log records by logger: {Logger.stats()}")
+        QueueLogging.stop()
 
     async def on_error(self, context, error):
         Logger.error(logger, error)
@@ -128,31 +172,83 @@ class Bot(discord.ext.commands.Bot):
         if isinstance(error, discord.ext.commands.MissingPermissions) and cmd_settings.get("visible"):
             notice = "You need the following permissions for this command: {}".format(", ".join([f"`{p}`" for p in error.missing_perms]))
             await utils.say(context.channel, content=notice)
-        elif isinstance(error, discord.ext.commands.NotOwner):
+        elif isinstance(error, (discord.ext.commands.NotOwner, discord.ext.commands.DisabledCommand)):
             return
         else:
             Logger.error(logger, error)
 
     def set_commands(self, *cmds):
-        self.add_cog(commands.Admin(self))
-        self.add_cog(commands.General(self))
-        self.add_cog(commands.Statistics(self))
+        for extension in commands.EXTENSIONS:
+            started_at = time.perf_counter()
+            self.load_extension(extension)
+            Logger.info(logger, f"Loaded {extension} in {time.perf_counter() - started_at:.2f}s")
 
         for c in cmds:
             self.add_cog(c)
 
-        for command in self.commands:
-            Logger.debug(logger, f"Setting up command '{command.name}'")
+        self.add_check(self.command_enabled)
+        self.apply_command_settings()
+
+    async def command_enabled(self, context):
+        """Global command check: stops commands that are disabled in the server's current config.
+
+        Checked on every use, so commands follow config reloads and settings saved in the database.
+        """
+        server_config = await Settings.load_server_config(context.guild.id) if context.guild else Settings.server_config()
+        cmd_settings = server_config.commands.get(context.command.qualified_name)
+        if cmd_settings and not cmd_settings.get("enabled", True):
+            raise discord.ext.commands.DisabledCommand(f"{context.command.qualified_name} is disabled.")
+
+        return True
+
+    def check_command_settings(self, snapshot=None):
+        """Checks that applying the commands config wouldn't make two commands share a name or alias.
+
+        Args:
+            snapshot(tuple): Config returned by `Settings.read_all` (defaults to the current config).
+
+        Raises:
+            AppError: A name or alias would be used more than once.
+
+        """
+        default_server_config = snapshot[1] if snapshot else Settings.server_config()
+        check_command_names(default_server_config.commands, [(c.name, c.aliases) for c in self.commands])
+
+    def apply_command_settings(self):
+        """Applies each command's config (aliases, help text, etc.).
+
+        Raises:
+            AppError: Two commands would share a name or alias (nothing is changed).
+
+        """
+        self.check_command_settings()
+        for command in list(self.commands):
+            Logger.debug(logger, lambda: f"Setting up command '{command.name}'")
             cmd_settings = Settings.command_settings(command.name)
             if not cmd_settings:
                 continue
 
-            command.aliases = cmd_settings.get("aliases", [])
+            # Re-register the command so alias changes take effect
+            previous_aliases = command.aliases
+            self.remove_command(command.name)
+            command.aliases = list(cmd_settings.get("aliases", []))
+            try:
+                self.add_command(command)
+            except discord.ClientException as e:
+                # Undo the partial registration (without touching whichever command has the alias)
+                # and keep the command usable under its old aliases
+                Logger.error(logger, f"Couldn't apply aliases of '{command.name}': {e}")
+                for name in [name for name, c in self.all_commands.items() if c is command]:
+                    del self.all_commands[name]
+                command.aliases = previous_aliases
+                self.add_command(command)
+                continue
+
             command.hidden = not cmd_settings.get("visible", True)
             command.description = cmd_settings.get("description", "")
             command.help = cmd_settings.get("help", "")
             command.usage = cmd_settings.get("usage", "")
-            Logger.debug(logger, f"Command '{command.name}' all set")
+            Logger.debug(logger, lambda: f"Command '{command.name}' all set")
 
     def set_events(self, *events):
         for e in events:
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+"""Command cogs, loaded by the bot as extensions (see Bot.set_commands)."""
 
-from .admin import Admin
-from .statistics import Statistics
-from .general import General
+EXTENSIONS = (
+    "main.commands.admin",
+    "main.commands.general",
+    "main.commands.statistics",
+)
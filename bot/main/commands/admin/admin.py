@@ -1,15 +1,19 @@
 """Admin commands"""
 import asyncio
 import datetime
+import itertools
 import logging
 
+import aiohttp
 import discord
 from discord.ext import commands
-import mee6_py_api
+import yaml
 
 from main import database, utils
+from main.activity import activity_index
 from main.logger import Logger
 from main.errors import AppError, ErrorCode
+from main.message_features import Mee6LevelUp
 from main.settings import Settings
 from main.status import CommandStatus
 from . import admin_dao, admin_utils
@@ -17,63 +21,188 @@ from . import admin_dao, admin_utils
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARN)
 
-async def get_inactive_members(context, progress_report=True):
-    """Returns a list of inactive members."""
-    progress_msg = None
-    included_channels = admin_dao.inactivelist_channels(context.guild)
-    active_members = []
-    inactive_members = []
-    current_channel = None
-    current_channel_index = 0
-    channel_count = len(included_channels)
-    channel_progress_stats = ""
-    channel_count_message = ""
-    current_channel_progress_message = ""
-
-    now = datetime.datetime.now()
-    days_threshold = admin_dao.inactive_threshold(context.guild.id)
-    time_boundary = now - datetime.timedelta(days=days_threshold)
+scan_results = admin_utils.ScanResultCache()
+
+# Most uses Discord allows for a single invite
+INVITE_MAX_USES_LIMIT = 100
+
+def indexed_inactive_members(server, time_boundary):
+    """Returns inactive members (discord.Member) according to the server's activity index."""
+    active_member_ids = {
+        member_id for member_id, when in activity_index.last_seen(server.id).items() if when >= time_boundary
+    }
+    return admin_utils.find_inactive_members(server.members, active_member_ids, time_boundary)
+
+async def backfill_activity_gap(context, time_boundary, progress_report=True):
+    """Restores activity tracking saved by an earlier run by scanning the history it's missing.
+
+    Only the history after the later of time_boundary and the end of the earlier tracking is read,
+    which is usually just the time the bot was offline.
+
+    Returns:
+        list: Inactive members (discord.Member), or None if the gap couldn't be backfilled
+            (so the server's history has to be scanned in full).
+
+    """
+    previous = activity_index.previous_coverage(context.guild.id)
+    if not previous or previous[0] > time_boundary:
+        return None
+
+    tracked_since, tracked_until = previous
+    scan_from = max(tracked_until, time_boundary)
+    if progress_report:
+        await utils.say(context.channel, content=f"Catching up on activity since {scan_from:%Y-%m-%d %H:%M} UTC...")
+
+    last_seen = {}
+    candidates_exhausted = False
+    try:
+        async for scan in admin_utils.scan_active_members(context.guild, scan_from):
+            last_seen = scan.last_seen
+            candidates_exhausted = scan.candidates_exhausted
+    except Exception as e:
+        Logger.warn(logger, f"Couldn't backfill activity in {context.guild.name} since {scan_from}: {e}")
+        return None
+
+    activity_index.merge(context.guild.id, last_seen)
+    if candidates_exhausted:
+        # Every member who could be inactive was seen, but the scan stopped early, so what it
+        # found is only a lower bound of their activity and can't restore the coverage
+        return admin_utils.find_inactive_members(context.guild.members, last_seen.keys(), time_boundary)
+
+    activity_index.mark_tracked(context.guild.id, tracked_since if scan_from == tracked_until else scan_from)
+    activity_index.discard_previous_coverage(context.guild.id)
+    return indexed_inactive_members(context.guild, time_boundary)
+
+async def scan_inactive_members(context, time_boundary, progress_report=True):
+    """Scans the server's message history for members who haven't been active since time_boundary.
+
+    The activity found is used to backfill the server's activity index. Progress is saved as the
+    scan goes, so a scan interrupted within the server's checkpoint window is resumed (keeping
+    the time boundary it was started with). Channels a resumed scan already completed aren't read
+    again, so messages sent in them since (e.g. while the bot was offline) are missed and the scan
+    can't backfill the index's coverage.
+
+    Activity tracking saved by an earlier run is restored instead if only the history since it
+    stopped needs scanning (see `backfill_activity_gap`).
+
+    Returns:
+        list: Inactive members (discord.Member).
+
+    """
+    backfilled = await backfill_activity_gap(context, time_boundary, progress_report=progress_report)
+    if backfilled is not None:
+        return backfilled
+
+    progress = None
+    checkpoint = None
+    checkpoint_window = admin_dao.inactivity_checkpoint_window(context.guild.id)
+    if checkpoint_window:
+        checkpoint = await admin_utils.ScanCheckpoint.resume(context.guild.id, time_boundary, checkpoint_window)
+        time_boundary = checkpoint.time_boundary
+    resumed = checkpoint is not None and checkpoint.is_resumed
+
+    plan = admin_utils.plan_scan(context.guild, time_boundary)
+    last_seen = {}
+    candidates_exhausted = False
+    reaction_requests_saved = 0
+    channel_count = len(plan.channels)
+    channels_completed = 0
+
+    skipped_message = ""
+    if plan.pruned_count:
+        skipped_message = (
+            f"\nSkipped {len(plan.pruned_inactive)} channels with no recent messages"
+            f" and {len(plan.pruned_forbidden)} channels I can't read."
+        )
+        Logger.debug(logger, lambda: f"Skipped scanning {plan.pruned_count} channels in {context.guild.name}")
+    if resumed:
+        skipped_message = (
+            f"{skipped_message}\nResuming an earlier scan ({len(checkpoint.completed)} channels already scanned)."
+        )
 
     if progress_report:
-        progress_content = f"Scanning {channel_count} channels for inactive members..."
-        progress_msg = await utils.say(context.channel, content=progress_content)
+        progress_content = f"Scanning {channel_count} channels for inactive members...{skipped_message}"
+        progress = utils.ProgressReporter(await utils.say(context.channel, content=progress_content))
 
-    async for scan in admin_utils.scan_active_members(context.guild, time_boundary):
+    async for scan in admin_utils.scan_active_members(context.guild, time_boundary, plan=plan, checkpoint=checkpoint):
         if isinstance(scan.error, discord.errors.Forbidden):
-            Logger.error(logger, f"Can't access {channel.name}")
+            Logger.error(logger, f"Can't access {scan.current_channel.name}")
             # TODO: Edit progress_msg to indicate channel can't be accessed
-        else:
-            # Update channel index
-            if current_channel != scan.current_channel:
-                current_channel_index += 1
-                current_channel = scan.current_channel
-                channel_count_message = (
-                    f"Scanning {current_channel_index}/{channel_count} channels for inactive members..."
-                )
+        elif progress and scan.current_channel:
+            # Channels are scanned concurrently, so report overall progress
+            progress.update(
+                f"Scanned {scan.channels_completed}/{channel_count} channels for inactive members...{skipped_message}"
+                f"```Latest channel: #{scan.current_channel.name}"
+                f"\nMessages scanned: {scan.messages_scanned}"
+                f"\n\nDate: {scan.message_time}```"
+            )
 
-            update_interval = 100
-            if progress_msg and not scan.current_channel_messages_scanned % update_interval:
-                channel_progress_stats = (
-                    f"\nMessages scanned: {scan.current_channel_messages_scanned}"
-                    f"\n\nDate: {scan.message_time}"
-                )
+        last_seen = scan.last_seen
+        channels_completed = scan.channels_completed
+        candidates_exhausted = scan.candidates_exhausted
+        reaction_requests_saved = scan.reaction_requests_saved
+
+    if reaction_requests_saved:
+        skipped_message = f"{skipped_message}\nSkipped {reaction_requests_saved} reaction lookups."
+        Logger.debug(logger, lambda: f"Saved {reaction_requests_saved} reaction requests scanning {context.guild.name}")
 
-            current_channel_progress_message = (
-                f"{channel_count_message}```Current channel: #{current_channel.name}{channel_progress_stats}```"
+    if progress:
+        if candidates_exhausted:
+            await progress.finish(
+                f"Stopped scanning after {channels_completed}/{channel_count} channels:"
+                f" every member has been active since the inactivity threshold.{skipped_message}"
             )
-            if progress_msg.content != current_channel_progress_message:
-                await progress_msg.edit(content=current_channel_progress_message)
+        else:
+            await progress.finish(f"Scanned {channel_count} channels for inactive members.{skipped_message}")
+
+    if checkpoint:
+        await checkpoint.clear()
+
+    # Backfill the activity index so later lookups don't need to scan again. A scan that
+    # stopped early only found a lower bound of each member's activity, and a resumed scan
+    # skipped recent messages in the channels it had completed, so neither can cover it.
+    activity_index.merge(context.guild.id, last_seen)
+    if not candidates_exhausted and not resumed:
+        activity_index.mark_tracked(context.guild.id, time_boundary)
+
+    # Activity recorded by the index (e.g. since the bot came back online) counts too
+    return indexed_inactive_members(context.guild, time_boundary)
 
-            active_members = scan.active_members
+async def get_inactive_members(context, progress_report=True):
+    """Returns a list of inactive members.
+
+    Answers from the server's activity index when it covers the inactivity threshold,
+    otherwise scans the server's message history (backfilling the index). Scan results are
+    shared with any other request for the same server and threshold for a while.
+    """
+    inactive_members = []
+    days_threshold = admin_dao.inactive_threshold(context.guild.id)
+    time_boundary = datetime.datetime.utcnow() - datetime.timedelta(days=days_threshold)
+
+    await activity_index.load(context.guild.id)
+    if activity_index.covers(context.guild.id, time_boundary):
+        results = indexed_inactive_members(context.guild, time_boundary)
+    else:
+        key = (context.guild.id, days_threshold)
+        if progress_report and scan_results.is_scanning(key):
+            notice = "A scan for inactive members is already running. I'll use its results once it's done."
+            await utils.say(context.channel, content=notice)
+
+        member_ids, age, reused = await scan_results.get(
+            key,
+            admin_dao.inactivity_result_ttl(context.guild.id),
+            lambda: scan_inactive_members(context, time_boundary, progress_report=progress_report)
+        )
+        results = [m for m in (context.guild.get_member(i) for i in member_ids) if m]
 
-    if progress_msg:
-        await progress_msg.edit(content=f"Scanned {channel_count} channels for inactive members.")
+        if progress_report and reused:
+            minutes = int(age.total_seconds() // 60)
+            age_description = f"{minutes} minute{'' if minutes == 1 else 's'} ago" if minutes else "just now"
+            await utils.say(context.channel, content=f"Using inactivity scan results from {age_description}.")
 
-    results = [
-        user for user in context.guild.members
-        if user not in active_members and user.joined_at < time_boundary and not user.bot
-    ]
-    db_inactive_members = [] # admin_dao.inactive_members(context.guild.id)
+    db_inactive_members = await asyncio.get_event_loop().run_in_executor(
+        None, admin_dao.inactive_members, context.guild.id
+    )
 
     for member in results:
         if member.id in db_inactive_members:
@@ -106,15 +235,29 @@ class Admin(commands.Cog):
 
         """
         self.bot = bot
+        self.notification_tasks = set()  # Kept so running batches of notices aren't garbage collected
+        self.sending_notices = set()  # Outbox IDs of notices currently being sent
 
     # --- Helper functions ---
-    async def inactivity_notification_invite(self, server: discord.Guild):
-        """Returns an Invite object for a given server's inactivity notifications"""
+    async def inactivity_notification_invites(self, server: discord.Guild, recipients: int):
+        """Returns Invite objects for a batch of a given server's inactivity notifications.
+
+        As few invites as possible are created, with enough uses between them for every recipient
+        to get 'message_invite_max_uses' uses (Discord allows at most 100 uses per invite).
+
+        Args:
+            server(discord.Guild): Server the invites are for.
+            recipients(int): Number of members being notified.
+
+        Returns:
+            list: The invite (discord.Invite) for each recipient, in order, or None if invites are disabled.
+
+        """
         inactivity_settings = admin_dao.server_inactivity_settings(server.id)
         if not inactivity_settings:
             raise AppError(
                 ErrorCode.ERR_FEATURE_NOT_FOUND,
-                "'inactivity' settings not found for server ID {context.guild.id}"
+                f"'inactivity' settings not found for server ID {server.id}"
             )
         elif not inactivity_settings.get("message_invite_enabled"):
             return None
@@ -130,61 +273,224 @@ class Admin(commands.Cog):
 
         # Translate hours to seconds for max_age
         max_age = 3600 * inactivity_settings.get("message_invite_hours", 0)
-        max_uses = inactivity_settings.get("message_invite_max_uses")
+        uses_per_member = min(inactivity_settings.get("message_invite_max_uses") or 0, INVITE_MAX_USES_LIMIT)
         reason = inactivity_settings.get("message_invite_reason")
 
-        invite = await invite_channel.create_invite(max_age=max_age, max_uses=max_uses, reason=reason)
-        return invite
+        if not uses_per_member:
+            # Unlimited uses, so everyone can share one invite
+            invite = await invite_channel.create_invite(max_age=max_age, max_uses=0, reason=reason)
+            return [invite] * recipients
+
+        members_per_invite = INVITE_MAX_USES_LIMIT // uses_per_member
+        invites = []
+        for start in range(0, recipients, members_per_invite):
+            batch_size = min(members_per_invite, recipients - start)
+            invite = await invite_channel.create_invite(
+                max_age=max_age, max_uses=batch_size * uses_per_member, reason=reason
+            )
+            invites.extend([invite] * batch_size)
+
+        return invites
 
     async def notify_members(self, context, members, message, use_case=None):
-        """Sends a notice to a list of members."""
-        success = []
-        failed = []
+        """Sends a notice to a list of members.
+
+        Any invites are created first, then every notice is queued in the database's outbox
+        before it's sent, so an interrupted batch can be resumed (see `notifyresume`) without
+        messaging anyone twice. The notices are sent in the background so the bot can keep
+        handling other commands.
+
+        Returns:
+            asyncio.Task: Task sending the notices (None if they couldn't be sent).
+
+        """
+        invites = None
         notify_progress_report = await utils.say(
             context.channel, content=f"Notifying {len(members)} members..."
         )
 
-        for member in members:
-            notification = message
+        if use_case == "inactivity":
+            try:
+                invites = await self.inactivity_notification_invites(context.guild, len(members))
+            except discord.HTTPException as e:
+                Logger.error(logger, e)
+                error_message = f"An error happened while creating invite: {e.text} (error code: {e.code})"
+                await utils.say(context.channel, content=f"{error_message}\nNo members were notified.")
+                return None
+            except AppError as e:
+                await utils.say(context.channel, content=f"Stopped notifying members due to error:\n```{e}```")
+                return None
+
+        # Placeholders are filled in now so resumed notices read the same as the rest of the batch
+        notification = utils.substitute_text(message, context)
+        notices = [
+            (m.id, f"{notification}\n{invites[i].url}" if invites else notification)
+            for i, m in enumerate(members)
+        ]
+        try:
+            entries = await self.bot.loop.run_in_executor(
+                None, database.add_outbox_entries, context.guild.id, use_case, context.channel.id, notices
+            )
+        except Exception as e:
+            Logger.error(logger, f"Couldn't queue notices: {e}")
+            await utils.say(context.channel, content="I couldn't queue the notices.\nNo members were notified.")
+            return None
 
-            if use_case == "inactivity":
-                try:
-                    invite = await self.inactivity_notification_invite(context.guild)
-                    if invite:
-                        notification = f"{notification}\n{invite.url}"
-                except discord.HTTPException as e:
-                    failed.append(member)
-                    Logger.error(logger, e)
-                    error_message = f"An error happened while creating invite: {e.text} (error code: {e.code})"
-                    await utils.say(context.channel, content=error_message)
+        progress = utils.ProgressReporter(notify_progress_report)
+        return self.start_notifications(context.guild, context.channel, entries, progress)
+
+    def start_notifications(self, server, channel, entries, progress):
+        """Sends queued notices in the background (see `send_notifications`).
+
+        Returns:
+            asyncio.Task: Task sending the notices.
+
+        """
+        def finished(task):
+            self.notification_tasks.discard(task)
+            if not task.cancelled() and task.exception():
+                error = task.exception()
+                Logger.error(logger, f"Failed sending notices in {server.name}: {error!r}", exc_info=error)
+
+        task = self.bot.loop.create_task(self.send_notifications(server, channel, entries, progress))
+        self.notification_tasks.add(task)
+        task.add_done_callback(finished)
+        return task
+
+    async def send_notifications(self, server, channel, entries, progress):
+        """Sends queued notices concurrently (paced by the direct message rate limit) and reports the results.
+
+        Notices that fail for a reason that may pass (rate limits, Discord server errors) are retried
+        with exponential backoff, up to the configured number of attempts. Each notice's delivery
+        state is saved as soon as it changes.
+
+        Args:
+            server(discord.Guild): Server the notices are from.
+            channel(discord.abc.Messageable): Where to report the results.
+            entries(list): Queued notices (database.OutboxEntry) to send.
+            progress(utils.ProgressReporter): Where to report how many notices have been sent.
+
+        """
+        # Skip notices already being sent (e.g. a resume while the original batch is still running)
+        entries = [e for e in entries if e.outbox_id not in self.sending_notices]
+        self.sending_notices.update(e.outbox_id for e in entries)
+
+        dm_limits = Settings.app_standards("rate_limits")["direct_message"]
+        bucket = utils.TokenBucket.for_route("direct_message", dm_limits["uses"], dm_limits["per_seconds"])
+        limiter = asyncio.Semaphore(dm_limits["concurrency"])
+        max_attempts = dm_limits.get("max_attempts", 1)
+        retry_seconds = dm_limits.get("retry_seconds", 30)
+        sent_count = 0
+        failed_count = 0
+        unsaved = set()
+
+        async def save(entry):
+            try:
+                saved = await self.bot.loop.run_in_executor(None, database.update_outbox_entry, entry)
+            except Exception as e:
+                Logger.error(logger, f"Couldn't save state of notice {entry.outbox_id}: {e}")
+                saved = False
+            if saved:
+                unsaved.discard(entry.outbox_id)
+            else:
+                unsaved.add(entry.outbox_id)
+
+        async def retry_or_fail(entry, error, transient, reset_after=None):
+            entry.attempts += 1
+            entry.last_error = str(error)
+            if transient and entry.attempts < max_attempts:
+                backoff = max(retry_seconds * 2 ** (entry.attempts - 1), reset_after or 0)
+                entry.next_attempt_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=backoff)
+                await save(entry)
+            else:
+                entry.state = "failed"
+
+        async def deliver(entry):
+            member = server.get_member(entry.member_id)
+            while entry.state == "pending":
+                if not member:
+                    entry.state = "failed"
+                    entry.last_error = "Member is no longer in the server."
                     break
-                except AppError as e:
-                    await utils.say(context.channel, content=f"Stopped notifying members due to error:\n```{e}```")
-                    return
 
+                delay = (entry.next_attempt_at - datetime.datetime.utcnow()).total_seconds()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                async with limiter:
+                    await bucket.acquire()
+                    try:
+                        await utils.say(member, content=entry.content)
+                    except discord.HTTPException as e:
+                        Logger.error(logger, e)
+                        reset_after = utils.rate_limit_reset_after(e)
+                        if reset_after and e.status == 429:
+                            bucket.pause(reset_after)
+                        await retry_or_fail(entry, e, e.status == 429 or e.status >= 500, reset_after)
+                    except discord.DiscordException as e:
+                        Logger.error(logger, e)
+                        await retry_or_fail(entry, e, transient=False)
+                    except (asyncio.TimeoutError, OSError, aiohttp.ClientError) as e:
+                        # Connection problems may pass
+                        Logger.error(logger, e)
+                        await retry_or_fail(entry, e, transient=True)
+                    else:
+                        entry.attempts += 1
+                        entry.last_error = None
+                        entry.state = "sent"
+
+            await save(entry)
+            if entry.state == "sent" and entry.use_case == "inactivity":
+                await self.bot.loop.run_in_executor(
+                    None, database.update_inactive_member,
+                    server.id, entry.member_id, datetime.datetime.now(datetime.timezone.utc)
+                )
+
+        async def notify(entry):
+            nonlocal sent_count, failed_count
             try:
-                await utils.say(member, context=context, parse=True, content=notification)
-            except discord.DiscordException as e:
-                failed.append(member)
-                Logger.error(logger, e)
+                await deliver(entry)
+            except Exception as e:
+                # Only this notice is affected; the rest of the batch carries on
+                Logger.error(logger, f"Error sending notice {entry.outbox_id}: {e}")
+                if entry.state == "pending":
+                    entry.state = "failed"
+                    entry.last_error = str(e)
+                    await save(entry)
+
+            if entry.state == "sent":
+                sent_count += 1
             else:
-                success.append(member)
+                failed_count += 1
 
-        if success:
-            messaged = "\n".join([f"{m.mention} [{m.display_name}]" for m in success])
-            report_embed = discord.Embed(
-                title="Notified Members",
-                description=messaged
+            progress.update(
+                f"Notifying {len(entries)} members... ({sent_count} notified, {failed_count} failed)"
             )
-            await utils.say(context.channel, embed=report_embed)
+
+        try:
+            await asyncio.gather(*[notify(e) for e in entries], return_exceptions=True)
+        finally:
+            # Notices whose state couldn't be saved stay marked as being sent, so a resume in the
+            # meantime doesn't send them again
+            self.sending_notices.difference_update(e.outbox_id for e in entries if e.outbox_id not in unsaved)
+            if unsaved:
+                Logger.warn(logger, f"Couldn't save the state of {len(unsaved)} notices in {server.name}.")
+
+        def describe(entry):
+            member = server.get_member(entry.member_id)
+            return f"{member.mention} [{member.display_name}]" if member else f"<@{entry.member_id}>"
+
+        success = [describe(e) for e in entries if e.state == "sent"]
+        failed = [describe(e) for e in entries if e.state == "failed"]
+        await progress.finish(f"Notified {len(success)}/{len(entries)} members.")
+
+        # Reports stay in embeds so the mentions in them don't ping anyone
+        for report_embed in utils.paginate_embeds(title="Notified Members", lines=success):
+            await utils.say(channel, embed=report_embed)
         if failed:
-            not_messaged = "\n".join([f"{m.mention} [{m.display_name}]" for m in failed])
-            report_embed = discord.Embed(
-                title="Failed to Notify",
-                description=not_messaged
-            )
-            notice_content = "Couldn't message the following inactive members:"
-            await utils.say(context.channel, content=notice_content, embed=report_embed)
+            await utils.say(channel, content="Couldn't message the following members:")
+            for report_embed in utils.paginate_embeds(title="Failed to Notify", lines=failed):
+                await utils.say(channel, embed=report_embed)
 
     async def notify_inactive_members(self, context, members=None):
         """Sends a notice to all inactive members."""
@@ -197,7 +503,8 @@ class Admin(commands.Cog):
             members = await get_inactive_members(context)
         members = [i.user for i in members]
 
-        await self.notify_members(context, members, message, use_case="inactivity")
+        if not await self.notify_members(context, members, message, use_case="inactivity"):
+            return CommandStatus.FAILED
         return CommandStatus.COMPLETED
 
     # --- Commands ---
@@ -217,10 +524,12 @@ class Admin(commands.Cog):
             inactive_list.append(entry)
 
         days_threshold = admin_dao.inactive_threshold(context.guild.id)
-        embeds = utils.split_embeds(
+        footer = "React 📧 below to notify them"
+        embeds = list(utils.paginate_embeds(
             title=f"Inactive Members ({days_threshold}+ days since last message)",
-            description="\n".join(inactive_list)
-        )
+            lines=inactive_list,
+            reserve=len(footer)
+        ))
 
         for i, embed in enumerate(embeds):
             if i < len(embeds) - 1:
@@ -229,7 +538,7 @@ class Admin(commands.Cog):
                 # Final message
                 inactivity_message = admin_dao.inactive_message(context.guild.id)
                 if inactivity_message:
-                    embed.set_footer(text="React 📧 below to notify them")
+                    embed.set_footer(text=footer)
                 report = await utils.say(context.channel, content=f"{context.author.mention}", embed=embed)
 
                 if inactivity_message:
@@ -259,6 +568,54 @@ class Admin(commands.Cog):
 
         await self.notify_inactive_members(context)
 
+    @commands.command()
+    @commands.has_guild_permissions(administrator=True)
+    async def notifyresume(self, context):
+        """Resume sending notices that haven't been delivered yet."""
+        cmd_settings = Settings.command_settings(context.command.name, context.guild.id)
+        if not cmd_settings.get("enabled"):
+            return
+
+        expiry_hours = Settings.app_defaults("notice_expiry_hours")
+        expired = 0
+        if expiry_hours:
+            queued_before = datetime.datetime.utcnow() - datetime.timedelta(hours=expiry_hours)
+            expired = await self.bot.loop.run_in_executor(
+                None, database.expire_outbox_entries, context.guild.id, queued_before
+            )
+        if expired:
+            await utils.say(
+                context.channel,
+                content=f"Dropped {expired} undelivered notices queued over {expiry_hours} hours ago."
+            )
+
+        entries = await self.bot.loop.run_in_executor(None, database.get_pending_outbox_entries, context.guild.id)
+        entries = [e for e in entries if e.outbox_id not in self.sending_notices]
+        if not entries:
+            await utils.say(context.channel, content="There are no undelivered notices to resume.")
+            return CommandStatus.COMPLETED
+
+        # Results go to wherever each batch was originally reported
+        batches = {}
+        for entry in entries:
+            batches.setdefault(entry.report_channel_id, []).append(entry)
+
+        for report_channel_id, batch in batches.items():
+            report_channel = context.guild.get_channel(report_channel_id) if report_channel_id else None
+            report_channel = report_channel or context.channel
+            if report_channel != context.channel:
+                await utils.say(
+                    context.channel,
+                    content=f"Resuming {len(batch)} undelivered notices. Results will be in {report_channel.mention}."
+                )
+
+            progress = utils.ProgressReporter(
+                await utils.say(report_channel, content=f"Resuming {len(batch)} undelivered notices...")
+            )
+            self.start_notifications(context.guild, report_channel, batch, progress)
+
+        return CommandStatus.COMPLETED
+
     @commands.command()
     @commands.has_guild_permissions(administrator=True)
     async def exempt(self, context):
@@ -384,9 +741,9 @@ class Admin(commands.Cog):
             await utils.say(context.channel, content="I can only edit messages I sent.")
             return CommandStatus.INVALID
         else:
-            for preview in utils.split_embeds(
+            for preview in utils.paginate_embeds(
                 title="Message Preview",
-                description=discord.utils.escape_markdown(to_edit.content),
+                lines=discord.utils.escape_markdown(to_edit.content).split("\n"),
                 url=to_edit.jump_url,
                 timestamp=to_edit.edited_at if to_edit.edited_at else to_edit.created_at
             ):
@@ -417,29 +774,118 @@ class Admin(commands.Cog):
         if not cmd_settings.get("enabled"):
             return
 
+        import mee6_py_api
+
         mee6 = mee6_py_api.API(context.guild.id)
-        member_ids = [str(m.id) for m in context.guild.members]
+        member_ids = {str(m.id) for m in context.guild.members}
         try:
             leaderboard_pages = await mee6.levels.get_all_leaderboard_pages()
-            i = 1
-            for page in leaderboard_pages:
-                players = page.get("players")
-                absent_members = [
-                    f"**{p.get('username')}**#{p.get('discriminator')} — lv{p.get('level')}"
-                    for p in players if p.get("id") not in member_ids
-                ]
-                if not absent_members:
-                    continue
-
-                report = discord.Embed(
-                    title=f"MEE6 leaderboard members who left the server (p. {i})",
-                    description="\n".join(absent_members)
-                )
-                await utils.say(context.channel, embed=report)
-                i += 1
+        except mee6_py_api.exceptions.HTTPRequestError:
+            await utils.say(context.channel, content="I couldn't find this server's MEE6 leaderboard.")
+            return
+
+        absent_members = (
+            f"**{p.get('username')}**#{p.get('discriminator')} — lv{p.get('level')}"
+            for page in leaderboard_pages for p in page.get("players") if p.get("id") not in member_ids
+        )
+        first = next(absent_members, None)
+        if not first:
+            await utils.say(context.channel, content="Everyone on the MEE6 leaderboard is still in the server.")
+            return
 
+        report = itertools.chain(["**MEE6 leaderboard members who left the server:**", first], absent_members)
+        await utils.say(context.channel, content=report)
+
+    @commands.command()
+    @commands.has_guild_permissions(administrator=True)
+    async def syncroles(self, context):
+        """Give members any MEE6 level roles they're missing."""
+        cmd_settings = Settings.command_settings(context.command.name, context.guild.id)
+        if not cmd_settings.get("enabled"):
+            return
+
+        server_config = await Settings.load_server_config(context.guild.id)
+        level_up_settings = server_config.on_message.get("mee6_level_up")
+        if not level_up_settings or not level_up_settings.get("enabled"):
+            await utils.say(context.channel, content="MEE6 level roles aren't set up for this server.")
+            return CommandStatus.FAILED
+        level_roles = Mee6LevelUp(level_up_settings)
+
+        import mee6_py_api
+
+        mee6 = mee6_py_api.API(context.guild.id)
+        try:
+            leaderboard_pages = await mee6.levels.get_all_leaderboard_pages()
         except mee6_py_api.exceptions.HTTPRequestError:
             await utils.say(context.channel, content="I couldn't find this server's MEE6 leaderboard.")
+            return CommandStatus.FAILED
+
+        # Only members missing a role need an edit
+        updates = []
+        for page in leaderboard_pages:
+            for player in page.get("players"):
+                member = context.guild.get_member(int(player.get("id")))
+                level = player.get("level", 0)
+                if member and level_roles.missing_roles(member, level):
+                    updates.append((member, level))
+
+        if not updates:
+            await utils.say(context.channel, content="Everyone on the MEE6 leaderboard has their level roles.")
+            return CommandStatus.COMPLETED
+
+        progress = utils.ProgressReporter(
+            await utils.say(context.channel, content=f"Updating the level roles of {len(updates)} members...")
+        )
+        edit_limits = Settings.app_standards("rate_limits")["member_edit"]
+        bucket = utils.TokenBucket.for_route("member_edit", edit_limits["uses"], edit_limits["per_seconds"])
+        limiter = asyncio.Semaphore(edit_limits["concurrency"])
+        roles_added = 0
+        updated_count = 0
+        failed_count = 0
+
+        async def update(member, level):
+            nonlocal roles_added, updated_count, failed_count
+            async with limiter:
+                await bucket.acquire()
+                try:
+                    roles_added += len(await level_roles.reconcile(member, level))
+                except discord.HTTPException as e:
+                    Logger.error(logger, e)
+                    failed_count += 1
+                    reset_after = utils.rate_limit_reset_after(e)
+                    if reset_after and e.status == 429:
+                        bucket.pause(reset_after)
+                else:
+                    updated_count += 1
+
+            progress.update(
+                f"Updating the level roles of {len(updates)} members... ({updated_count} updated, {failed_count} failed)"
+            )
+
+        await asyncio.gather(*[update(m, level) for m, level in updates])
+        await progress.finish(
+            f"Updated the level roles of {updated_count}/{len(updates)} members ({roles_added} roles added)."
+        )
+        return CommandStatus.COMPLETED
+
+    @commands.command()
+    @commands.is_owner()
+    async def reloadconfig(self, context):
+        """Reload config files without restarting."""
+        try:
+            changes = await Settings.reload(check=self.bot.check_command_settings)
+        except (AppError, OSError, yaml.YAMLError) as e:
+            Logger.error(logger, f"Couldn't reload config: {e}")
+            await utils.say(context.channel, content=f"Kept the current config due to error:\n```{e}```")
+            return CommandStatus.FAILED
+
+        self.bot.apply_command_settings()
+        if not changes:
+            await utils.say(context.channel, content="Reloaded config. Nothing changed.")
+        else:
+            summary = itertools.chain([f"Reloaded config with {len(changes)} changes:", "```"], changes, ["```"])
+            await utils.say(context.channel, content=summary)
+        return CommandStatus.COMPLETED
 
     @commands.command()
     @commands.is_owner()
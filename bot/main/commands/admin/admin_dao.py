@@ -2,6 +2,7 @@
 import datetime
 import logging
 import discord
+from main import database
 from main.settings import Settings
 from main.logger import Logger
 
@@ -10,68 +11,50 @@ logger = logging.getLogger(__name__)
 
 def server_inactivity_settings(server_id):
     """Returns a server's inactivity configuration"""
-    default_features = Settings.default_features("inactivity")
-    server_features = Settings.server_features(server_id, "inactivity")
-    if not server_features:
-        return default_features
-    
-    # Combine default settings with server settings if not present already
-    if default_features:
-        for value in default_features:
-            if value not in server_features:
-                server_features[value] = default_features[value]
-
-    return server_features
+    return Settings.server_config(server_id).inactivity
 
-def inactive_threshold(server_id=None):
-    """Returns the minimum amount of days for a server member to be considered inactive."""
-    if server_id:
-        server_config = Settings.server_features(server_id, "inactivity")
-        if server_config:
-            try:
-                return server_config["days_threshold"]
-            except KeyError as err:
-                Logger.debug(logger, f"'inactivity' config for server ID {server_id} is missing a setting for 'days_threshold'. Using default setting instead.")
-    
+def _inactivity_setting(server_id, setting, fallback):
+    """Returns a server's 'inactivity' setting (combined with the default config), or fallback if it's missing."""
     try:
-        return Settings.default_features("inactivity")["days_threshold"]
+        return Settings.server_config(server_id).inactivity[setting]
     except KeyError as err:
-        Logger.warn(logger, f"Missing a default setting for 'inactivity' feature: 'days_threshold'. {err}")
-        return 14
+        Logger.warn(logger, f"Missing a default setting for 'inactivity: {setting}'. {err}")
+
+    return fallback
+
+def inactive_threshold(server_id=None):
+    """Returns the minimum amount of days for a server member to be considered inactive."""
+    return _inactivity_setting(server_id, "days_threshold", 14)
 
 def inactive_message(server_id):
-    default_config = Settings.default_features("inactivity")
-    server_config = Settings.server_features(server_id, "inactivity")
-    message_enabled = default_config["message_enabled"]
-    if server_config:
-        message_enabled = server_config.get("message_enabled", message_enabled)
-        
-    if message_enabled:
-        if server_config:
-            try:
-                return server_config["message"]
-            except KeyError:
-                Logger.debug(logger, f"'inactivity' config for server ID {server_id} is missing a setting for 'message'. Using default setting instead.")
-        
-        return default_config["message"]
-    
+    inactivity_settings = Settings.server_config(server_id).inactivity
+    if inactivity_settings.get("message_enabled"):
+        return inactivity_settings.get("message")
+
     return None
 
 def include_reactions_inactivity(server_id=None):
-    if server_id:
-        server_config = Settings.server_features(server_id, "inactivity")
-        if server_config:
-            try:
-                return server_config["include_reactions"]
-            except KeyError as err:
-                Logger.debug(logger, f"'inactivity' config for server ID {server_id} is missing a setting for 'include_reactions'. Using default setting instead.")
-    
-    try:
-        return Settings.default_features("inactivity")["include_reactions"]
-    except KeyError as err:
-        Logger.warn(logger, f"Missing a default setting for 'inactivity: include_reactions'. {err}")
-    
-    return True
+    return _inactivity_setting(server_id, "include_reactions", True)
+
+def inactivity_scan_concurrency(server_id=None):
+    """Returns how many channels can be scanned at once when looking for inactive members."""
+    return max(1, _inactivity_setting(server_id, "scan_concurrency", 1))
+
+def inactivity_reaction_concurrency(server_id=None):
+    """Returns how many reaction user lookups can run at once when looking for inactive members."""
+    return max(1, _inactivity_setting(server_id, "reaction_concurrency", 1))
+
+def inactivity_checkpoint_window(server_id=None):
+    """Returns how long an interrupted inactivity scan can be resumed for (0 if it can't be)."""
+    return datetime.timedelta(hours=_inactivity_setting(server_id, "checkpoint_window_hours", 0))
+
+def inactivity_result_ttl(server_id=None):
+    """Returns how long the results of an inactivity scan can be reused for."""
+    return datetime.timedelta(minutes=_inactivity_setting(server_id, "result_cache_minutes", 0))
+
+def inactive_members(server_id: int):
+    """Returns a server's saved inactive members {member_id: database.InactiveMember}."""
+    return database.get_all_inactive_members(server_id)
 
 def inactivelist_channels(server: discord.Guild):
     return server.text_channels
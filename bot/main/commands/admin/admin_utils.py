@@ -1,24 +1,62 @@
+import asyncio
+import collections
 import datetime
+import time
 import discord
+from main import database
 from . import admin_dao
 
 class ActivityScan():
     """Object containing info about server activity scan's current progress.
 
+    Several channels may be scanned at once, so the "current" attributes refer to
+    whichever channel the latest message (or error) came from.
+
     Attributes:
         current_message (discord.Message): Current message being scanned.
         current_channel (discord.TextChannel): Current channel being scanned.
-        current_channel_messages_scanned (int): Number of messages that have already been scanned in current channel.
+        channel_messages_scanned (dict): Number of messages scanned so far in each channel {channel_id: int}.
+        channels_completed (int): Number of channels that have been fully scanned (or couldn't be accessed).
+        messages_scanned (int): Number of messages scanned so far across all channels.
         error (discord.DiscordException): Current error being thrown (Resets to None if no errors).
-        active_members (list of discord.Member): List of members identified as active on the server during scan.
+        last_seen (dict): Latest activity found for each active member {member_id: datetime (UTC)}.
+        remaining_candidates (set of int): IDs of members who could be inactive and haven't been seen yet.
+        candidates_exhausted (bool): True if the scan stopped early because every candidate was seen.
+        reactions (ReactionResolver): Finds who reacted to scanned messages (None if reactions aren't included).
 
     """
-    def __init__(self):
+    def __init__(self, candidates=None):
         self.current_message = None
         self.current_channel = None
-        self.current_channel_messages_scanned = 0
+        self.channel_messages_scanned = {}
+        self.channels_completed = 0
+        self.messages_scanned = 0
         self.error = None
-        self.active_members = []
+        self.last_seen = {}
+        self.remaining_candidates = set(candidates or ())
+        self.candidates_exhausted = False
+        self.reactions = None
+
+    def mark_active(self, member_id, when):
+        last_seen = self.last_seen.get(member_id)
+        if last_seen is None or when > last_seen:
+            self.last_seen[member_id] = when
+        self.remaining_candidates.discard(member_id)
+
+    @property
+    def active_member_ids(self):
+        """Set-like view of the IDs of members identified as active on the server during scan."""
+        return self.last_seen.keys()
+
+    @property
+    def reaction_requests_saved(self):
+        return self.reactions.requests_saved if self.reactions else 0
+
+    @property
+    def current_channel_messages_scanned(self):
+        if self.current_channel:
+            return self.channel_messages_scanned.get(self.current_channel.id, 0)
+        return 0
 
     @property
     def message_time(self):
@@ -27,46 +65,501 @@ class ActivityScan():
         return ""
 
 
-async def scan_active_members(server: discord.Guild, time_boundary):
-    """Yields a list of active members.
-    
+class ScanPlan():
+    """Channels to be scanned for activity, after leaving out those that can't have any.
+
+    Attributes:
+        channels (list of discord.TextChannel): Channels to scan.
+        pruned_inactive (list of discord.TextChannel): Channels with no messages since the time boundary.
+        pruned_forbidden (list of discord.TextChannel): Channels the bot can't read the history of.
+
+    """
+    def __init__(self):
+        self.channels = []
+        self.pruned_inactive = []
+        self.pruned_forbidden = []
+
+    @property
+    def pruned_count(self):
+        return len(self.pruned_inactive) + len(self.pruned_forbidden)
+
+
+def plan_scan(server: discord.Guild, time_boundary) -> ScanPlan:
+    """Picks which of a server's channels need their history scanned, without any API calls.
+
+    A channel is skipped if the bot can't read its history, or if its last message
+    (by the creation time in its snowflake ID) is older than time_boundary.
+
     Args:
         server (discord.Guild): Guild object
-        time_boundary (date)
+        time_boundary (datetime.datetime): Naive UTC time to look for activity after.
 
-    Yields:
-        list: If successful, yields list of active members (discord.Member) found so far by the scan.
-        discord.errors.Forbidden: If unable to access current channel, yields error.
+    Returns:
+        ScanPlan: Channels to scan, and the channels that were skipped.
 
     """
-    current_scan = ActivityScan()
-    include_reactions = admin_dao.include_reactions_inactivity(server.id)
-    included_channels = admin_dao.inactivelist_channels(server)
+    plan = ScanPlan()
+    for channel in admin_dao.inactivelist_channels(server):
+        permissions = channel.permissions_for(server.me)
+        if not (permissions.read_messages and permissions.read_message_history):
+            plan.pruned_forbidden.append(channel)
+        elif not channel.last_message_id or discord.utils.snowflake_time(channel.last_message_id) < time_boundary:
+            plan.pruned_inactive.append(channel)
+        else:
+            plan.channels.append(channel)
+
+    return plan
+
+
+class ScanResultCache():
+    """Keeps the results of inactivity scans for a limited time.
+
+    Results are kept as member IDs per key (e.g. (server ID, days threshold)). Requests for a key
+    while its scan is still running wait for that scan instead of starting another.
+    """
+    def __init__(self):
+        self._results = {}  # {key: (finished_at, [member_id])}
+        self._scans = {}  # {key: asyncio.Future}
+
+    def is_scanning(self, key) -> bool:
+        return key in self._scans
+
+    async def get(self, key, ttl: datetime.timedelta, scan):
+        """Returns the result for a key, only scanning if there's no recent result or scan running.
 
-    for i, channel in enumerate(included_channels):
+        Args:
+            key: Identifies what's being scanned.
+            ttl (datetime.timedelta): How long a result can be reused for.
+            scan: Coroutine function that scans and returns a list of inactive members (discord.Member).
+
+        Returns:
+            tuple: (list of member IDs, age of the result as datetime.timedelta, True if it came from an earlier or shared scan)
+
+        """
+        cached = self._results.get(key)
+        if cached and time.monotonic() - cached[0] < ttl.total_seconds():
+            return cached[1], datetime.timedelta(seconds=time.monotonic() - cached[0]), True
+
+        reused = True
+        task = self._scans.get(key)
+        if not task:
+            reused = False
+            task = asyncio.ensure_future(self._scan(key, scan))
+            self._scans[key] = task
+
+        # Shielded so one requester giving up doesn't cancel the scan for the others
+        finished_at, member_ids = await asyncio.shield(task)
+        return member_ids, datetime.timedelta(seconds=time.monotonic() - finished_at), reused
+
+    def invalidate(self, key):
+        self._results.pop(key, None)
+
+    async def _scan(self, key, scan):
         try:
-            current_scan.current_channel = channel
-            current_scan.current_channel_messages_scanned = 0
+            members = await scan()
+            self._results[key] = (time.monotonic(), [m.id for m in members])
+            return self._results[key]
+        finally:
+            self._scans.pop(key, None)
+
+
+class ScanCheckpoint():
+    """Saved progress of an activity scan, so an interrupted scan can pick up where it left off.
+
+    Attributes:
+        guild_id (int): ID of the server being scanned.
+        time_boundary (datetime.datetime): Naive UTC time the scan looks for activity after.
+        positions (dict): Last message ID processed in each channel {channel_id: message_id}.
+        completed (set of int): IDs of channels that have been fully scanned.
+        last_seen (dict): Activity found before the scan was resumed {member_id: datetime (UTC)}.
+        save_interval (int): Number of messages to scan between saves.
+
+    """
+    def __init__(self, guild_id, time_boundary, positions=None, completed=None, last_seen=None, save_interval=500):
+        self.guild_id = guild_id
+        self.time_boundary = time_boundary
+        self.positions = positions or {}
+        self.completed = completed or set()
+        self.last_seen = last_seen or {}
+        self.save_interval = save_interval
+        self._changed_channels = set()
+        self._new_activity = {}
+        self._unsaved_messages = 0
+
+    @classmethod
+    async def resume(cls, guild_id, time_boundary, window: datetime.timedelta):
+        """Returns the checkpoint of a scan started up to `window` before this one (or a new checkpoint).
+
+        Checkpoints too old to be resumed are deleted.
+        """
+        loop = asyncio.get_event_loop()
+        earliest = time_boundary - window
+        await loop.run_in_executor(
+            None, database.delete_scan_checkpoints, guild_id, earliest - datetime.timedelta(microseconds=1)
+        )
+
+        checkpoint_boundary = await loop.run_in_executor(
+            None, database.get_scan_checkpoint_boundary, guild_id, earliest, time_boundary
+        )
+        if not checkpoint_boundary:
+            return cls(guild_id, time_boundary)
+
+        positions, completed, last_seen = await loop.run_in_executor(
+            None, database.get_scan_checkpoint, guild_id, checkpoint_boundary
+        )
+        return cls(guild_id, checkpoint_boundary, positions, completed, last_seen)
+
+    @property
+    def is_resumed(self):
+        return bool(self.positions or self.completed)
+
+    @property
+    def is_due(self):
+        """True if enough messages have been scanned since the last save."""
+        return self._unsaved_messages >= self.save_interval
+
+    def advance(self, channel_id, message_id, activity):
+        """Records a scanned message and the activity (iterable of (member_id, datetime)) found in it."""
+        self.positions[channel_id] = message_id
+        self._changed_channels.add(channel_id)
+        for member_id, when in activity:
+            last_seen = self._new_activity.get(member_id)
+            if last_seen is None or when > last_seen:
+                self._new_activity[member_id] = when
+        self._unsaved_messages += 1
+
+    def complete(self, channel_id):
+        self.completed.add(channel_id)
+        self._changed_channels.add(channel_id)
+
+    async def save(self):
+        """Saves progress made since the last save."""
+        if not self._changed_channels and not self._new_activity:
+            return
+
+        channels = [(c, self.positions.get(c), c in self.completed) for c in self._changed_channels]
+        members = list(self._new_activity.items())
+        self._changed_channels = set()
+        self._new_activity = {}
+        self._unsaved_messages = 0
+
+        loop = asyncio.get_event_loop()
+        saved = await loop.run_in_executor(
+            None, database.save_scan_checkpoint, self.guild_id, self.time_boundary, channels, members
+        )
+        if not saved:
+            # Keep the progress so it's included in the next save
+            self._changed_channels.update(c[0] for c in channels)
+            for member_id, when in members:
+                self._new_activity[member_id] = max(when, self._new_activity.get(member_id, when))
+
+    async def clear(self):
+        """Deletes the saved progress (e.g. once the scan has finished)."""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, database.delete_scan_checkpoints, self.guild_id, self.time_boundary)
+
+
+class ReactionResolver():
+    """Finds who reacted to scanned messages, with a limited number of requests running at once.
+
+    Reactions are skipped (without any requests) when no members who could be inactive remain
+    unseen, or when the only reaction is the bot's own. Repeated requests for the same message
+    and emoji share one lookup.
+
+    Attributes:
+        remaining_candidates (set of int): IDs of members not seen yet (updated by the scan).
+        requests_made (int): Number of reaction user requests made.
+        requests_saved (int): Number of reaction user requests that were skipped or shared.
+
+    """
+    page_size = 100
+
+    def __init__(self, concurrency: int, remaining_candidates: set, me_id: int):
+        self.remaining_candidates = remaining_candidates
+        self.requests_made = 0
+        self.requests_saved = 0
+        self._me_id = me_id
+        self._limiter = asyncio.Semaphore(concurrency)
+        self._lookups = {}  # {(message_id, emoji): asyncio.Future}
+        self._resolved = set()  # {(message_id, emoji)}
+
+    def resolve(self, message: discord.Message):
+        """Starts finding the IDs of members who reacted to a message.
+
+        Returns:
+            asyncio.Future: Resolves to a set of member IDs.
+
+        """
+        lookups = [self._lookup(message, react) for react in message.reactions]
+        return asyncio.ensure_future(self._combine(lookups))
+
+    def close(self):
+        for lookup in list(self._lookups.values()):
+            lookup.cancel()
+        self._lookups = {}
+
+    def _pages(self, react):
+        return -(-react.count // self.page_size)
+
+    def _lookup(self, message, react):
+        key = (message.id, str(react.emoji))
+        lookup = self._lookups.get(key)
+        if lookup:
+            self.requests_saved += self._pages(react)
+        elif key in self._resolved:
+            # Already found (and recorded) with the same message
+            self.requests_saved += self._pages(react)
+            lookup = asyncio.ensure_future(self._none())
+        else:
+            lookup = asyncio.ensure_future(self._users(react))
+            self._lookups[key] = lookup
+            lookup.add_done_callback(lambda _: self._finish_lookup(key))
+        return lookup
+
+    def _finish_lookup(self, key):
+        self._lookups.pop(key, None)
+        self._resolved.add(key)
+
+    async def _none(self):
+        return set()
+
+    async def _combine(self, lookups):
+        reactors = set()
+        for user_ids in await asyncio.gather(*lookups):
+            reactors.update(user_ids)
+        return reactors
+
+    async def _users(self, react):
+        if react.count == 1 and react.me:
+            self.requests_saved += 1
+            return {self._me_id}
+
+        async with self._limiter:
+            # Checked once a slot is free, since candidates may have been seen while waiting
+            if not self.remaining_candidates:
+                self.requests_saved += self._pages(react)
+                return set()
+
+            self.requests_made += self._pages(react)
+            return {user.id async for user in react.users()}
 
+
+async def _scan_channel(
+    channel,
+    time_boundary,
+    reactions: ReactionResolver,
+    results: asyncio.Queue,
+    limiter: asyncio.Semaphore,
+    max_pending=100
+):
+    """Reads a channel's history after time_boundary and puts what it finds in the results queue.
+
+    time_boundary can also be a message (or discord.Object) to read the history after.
+
+    Each message is put as (channel, message, reaction user IDs, None), in order. Reactions are
+    looked up in the background (if a resolver is given) while the history keeps being read,
+    with up to max_pending messages waiting on them. Once the channel is done,
+    (channel, None, None, error) is put, where error is None if the whole channel was read, or
+    whatever was raised while reading it (so the consumer can decide whether to go on).
+    """
+    error = None
+    cancelled = False
+    pending = collections.deque()
+
+    async def put_ready(wait=False):
+        while pending and (wait or len(pending) > max_pending or not pending[0][1] or pending[0][1].done()):
+            message, reactors = pending.popleft()
+            await results.put((channel, message, await reactors if reactors else set(), None))
+
+    try:
+        async with limiter:
             async for message in channel.history(
                 limit=None,
                 after=time_boundary,
                 oldest_first=True
-             ):
-                current_scan.error = None
-                current_scan.current_message = message
-                if message.author not in current_scan.active_members:
-                    current_scan.active_members.append(message.author)
-
-                if include_reactions:
-                    for react in message.reactions:
-                        async for user in react.users():
-                            if user not in current_scan.active_members:
-                                current_scan.active_members.append(user)
-
-                current_scan.current_channel_messages_scanned += 1
+            ):
+                pending.append((message, reactions.resolve(message) if reactions and message.reactions else None))
+                await put_ready()
+
+            await put_ready(wait=True)
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    except Exception as err:
+        error = err
+    finally:
+        for _, reactors in pending:
+            if reactors:
+                reactors.cancel()
+        # Nothing is waiting on the results once the scan's been cancelled
+        if not cancelled:
+            await results.put((channel, None, None, error))
+
+
+async def _next_result(results: asyncio.Queue, workers: dict):
+    """Gets the next item from the results of a scan's channel workers (see `_scan_channel`).
+
+    Raises whatever stopped a worker if it died without putting the end of its channel, rather
+    than waiting on results that will never come.
+    """
+    if not results.empty():
+        return results.get_nowait()
+
+    getter = asyncio.ensure_future(results.get())
+    try:
+        while True:
+            if getter.done():
+                return getter.result()
+
+            for worker, channel in workers.items():
+                if worker.done() and worker.cancelled():
+                    raise RuntimeError(f"Scan of #{channel.name} was cancelled before it finished")
+                if worker.done() and worker.exception():
+                    raise worker.exception()
+
+            running = [w for w in workers if not w.done()]
+            if not running and results.empty():
+                # Every worker has ended, so nothing more is coming
+                raise RuntimeError("Channel scans ended without reporting all of their results")
+
+            done, _ = await asyncio.wait([getter, *running], return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                return getter.result()
+    finally:
+        if not getter.done():
+            getter.cancel()
+
+
+async def scan_active_members(
+    server: discord.Guild,
+    time_boundary,
+    plan: ScanPlan = None,
+    checkpoint: ScanCheckpoint = None
+):
+    """Yields a list of active members.
+
+    Channels are read concurrently, up to the server's 'scan_concurrency' setting at a time.
+    The scan stops as soon as every member who could be inactive (non-bot members who joined
+    before time_boundary) has been seen, so `last_seen` is only a lower bound in that case.
+    
+    Args:
+        server (discord.Guild): Guild object
+        time_boundary (date)
+        plan (ScanPlan): Channels to scan (planned with `plan_scan` if not given).
+        checkpoint (ScanCheckpoint): Saved progress to resume from and to keep saving progress to.
+
+    Yields:
+        ActivityScan: Progress of the scan, after every message scanned and every channel completed.
+            If a channel can't be accessed, its `error` is set to the discord.errors.Forbidden raised.
+
+    """
+    candidates = [m.id for m in server.members if not m.bot and m.joined_at < time_boundary]
+    current_scan = ActivityScan(candidates=candidates)
+    if checkpoint:
+        for member_id, when in checkpoint.last_seen.items():
+            current_scan.mark_active(member_id, when)
+
+    if not current_scan.remaining_candidates:
+        current_scan.candidates_exhausted = True
+        yield current_scan
+        return
+
+    included_channels = (plan or plan_scan(server, time_boundary)).channels
+    concurrency = admin_dao.inactivity_scan_concurrency(server.id)
+    if admin_dao.include_reactions_inactivity(server.id):
+        current_scan.reactions = ReactionResolver(
+            admin_dao.inactivity_reaction_concurrency(server.id),
+            current_scan.remaining_candidates,
+            server.me.id
+        )
+
+    positions = {}
+    if checkpoint:
+        remaining_channels = [c for c in included_channels if c.id not in checkpoint.completed]
+        current_scan.channels_completed = len(included_channels) - len(remaining_channels)
+        included_channels = remaining_channels
+        positions = checkpoint.positions
+
+    # Bounded so fast channels can't pile up messages faster than they're processed
+    results = asyncio.Queue(maxsize=concurrency * 100)
+    limiter = asyncio.Semaphore(concurrency)
+    workers = {
+        asyncio.ensure_future(_scan_channel(
+            channel,
+            discord.Object(id=positions[channel.id]) if channel.id in positions else time_boundary,
+            current_scan.reactions,
+            results,
+            limiter
+        )): channel
+        for channel in included_channels
+    }
+    if not workers:
+        yield current_scan
+        return
+
+    try:
+        channels_remaining = len(workers)
+        while channels_remaining:
+            channel, message, reactors, error = await _next_result(results, workers)
+            current_scan.current_channel = channel
+            current_scan.error = error
+
+            if message is None:
+                channels_remaining -= 1
+                current_scan.channels_completed += 1
+                if error and not isinstance(error, discord.errors.Forbidden):
+                    raise error
+                if checkpoint and not error:
+                    checkpoint.complete(channel.id)
+                    await checkpoint.save()
+                yield current_scan
+                continue
+
+            current_scan.current_message = message
+            current_scan.mark_active(message.author.id, message.created_at)
+
+            for user_id in reactors:
+                # Reaction times aren't available, so the message's time is the closest estimate
+                current_scan.mark_active(user_id, message.created_at)
+
+            current_scan.channel_messages_scanned[channel.id] = current_scan.current_channel_messages_scanned + 1
+            current_scan.messages_scanned += 1
+            if checkpoint:
+                activity = [(message.author.id, message.created_at)]
+                activity.extend((user_id, message.created_at) for user_id in reactors)
+                checkpoint.advance(channel.id, message.id, activity)
+                if checkpoint.is_due:
+                    await checkpoint.save()
+
+            if not current_scan.remaining_candidates:
+                # Everyone who could be inactive has been seen, so the rest can't change the result
+                current_scan.candidates_exhausted = True
                 yield current_scan
+                return
 
-        except discord.errors.Forbidden as err_forbidden:
-            current_scan.error = err_forbidden
             yield current_scan
+    finally:
+        for worker in workers:
+            worker.cancel()
+        if current_scan.reactions:
+            current_scan.reactions.close()
+
+
+def find_inactive_members(members, active_member_ids, time_boundary):
+    """Returns members who could have been active since time_boundary but weren't.
+
+    Bots and members who joined after time_boundary are left out. Runs in linear time,
+    so active_member_ids should be a set (or set-like view) of member IDs.
+
+    Args:
+        members (list of discord.Member): Members of the server.
+        active_member_ids (set of int): IDs of members who were active since time_boundary.
+        time_boundary (datetime.datetime): Naive UTC time that activity was looked for after.
+
+    Returns:
+        list: Inactive members (discord.Member), in the same order as members.
+
+    """
+    candidates = {m.id: m for m in members if not m.bot and m.joined_at < time_boundary}
+    inactive_ids = candidates.keys() - active_member_ids
+    return [m for member_id, m in candidates.items() if member_id in inactive_ids]
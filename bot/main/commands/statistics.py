@@ -6,15 +6,15 @@ import re
 import discord
 from discord.ext import commands
 import multidict
-from wordcloud import WordCloud
-from matplotlib.image import imread
-from spacy.lang.en.stop_words import STOP_WORDS
 
 from main import utils
 from main.settings import Settings
 from main.status import CommandStatus
 
 def get_word_frequencies(text):
+    # spaCy is slow to import, so it's only loaded once a word cloud is made
+    from spacy.lang.en.stop_words import STOP_WORDS
+
     fullTermsDict = multidict.MultiDict()
     tempDict = {}
     text = text.lower()
@@ -59,10 +59,17 @@ class Statistics(commands.Cog):
             subject = f"#{channels[0].name}"
 
         report = await utils.say(context.channel, content=f"Scanning {subject}'s past {days} days...")
+        progress = utils.ProgressReporter(report)
+        messages_scanned = 0
 
         for channel in channels:
             try:
                 async for m in channel.history(limit=None, after=(now - datetime.timedelta(days=days)), oldest_first=False):
+                    messages_scanned += 1
+                    progress.update(
+                        f"Scanning {subject}'s past {days} days..."
+                        f"```Current channel: #{channel.name}\nMessages scanned: {messages_scanned}```"
+                    )
                     if user:
                         if m.author == user:
                             messages.append(m.clean_content)
@@ -74,7 +81,11 @@ class Statistics(commands.Cog):
                 print(f"Can't access {channel.name}")
         
         if messages:
+            from wordcloud import WordCloud
+
             if "picture provided" == "":
+                from matplotlib.image import imread
+
                 img_mask = imread("wordcloud/mask.png")
                 wc = WordCloud(background_color=None, mask=img_mask, contour_width=2, contour_color="white")
             else:
@@ -90,7 +101,13 @@ class Statistics(commands.Cog):
             wc_filepath = os.path.join(wc_dir, wc_filename)
             wc.to_file(wc_filepath)
 
+            progress.cancel()
             await report.delete()
             await utils.say(context.channel, content=f"{context.author.mention} A wordcloud for {subject}'s past {days} days:", file=discord.File(wc_filepath))
         else:
+            await progress.finish(f"Scanned {subject}'s past {days} days ({messages_scanned} messages).")
             await utils.say(context.channel, content=f"{context.author.mention} No words found from {subject} in the past {days} days.")
+
+
+def setup(bot):
+    bot.add_cog(Statistics(bot))
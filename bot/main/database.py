@@ -1,9 +1,19 @@
 from contextlib import contextmanager
+import json
+import threading
 import psycopg2
 from psycopg2 import pool, sql
+from psycopg2.extras import execute_values
 from main.settings import Settings
 
-db_pool = pool.SimpleConnectionPool(1, 10, dsn=Settings.config["env"]["database_url"], sslmode="require")
+DB_POOL_MIN_CONNECTIONS = 1
+DB_POOL_MAX_CONNECTIONS = 10
+DB_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+
+db_pool = None
+db_pool_lock = threading.Lock()
+# The pool raises an error rather than wait when every connection is in use, so callers wait here instead
+db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
 
 
 class InactiveMember():
@@ -15,15 +25,66 @@ class InactiveMember():
         self.user = user
 
 
+class OutboxEntry():
+    """A notice queued to be sent to a member.
+
+    Attributes:
+        state(str): "pending" until the notice is delivered ("sent") or given up on ("failed", or
+            "expired" if it was still pending after `notice_expiry_hours`).
+        next_attempt_at(datetime.datetime): Earliest time (UTC) to try sending again.
+
+    """
+    def __init__(self, outbox_id, guild_id, member_id, content, use_case=None, report_channel_id=None,
+                 state="pending", attempts=0, next_attempt_at=None, last_error=None):
+        self.outbox_id = outbox_id
+        self.guild_id = guild_id
+        self.member_id = member_id
+        self.content = content
+        self.use_case = use_case
+        self.report_channel_id = report_channel_id
+        self.state = state
+        self.attempts = attempts
+        self.next_attempt_at = next_attempt_at
+        self.last_error = last_error
+
+
+def get_pool():
+    """Returns the connection pool, opening it on first use (database calls run in executor threads)."""
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_pool = pool.ThreadedConnectionPool(
+                    DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS,
+                    dsn=Settings.config["env"]["database_url"], sslmode="require"
+                )
+
+    return db_pool
+
 @contextmanager
 def db():
-    conn = db_pool.getconn()
-    cur = conn.cursor()
+    """Yields a (connection, cursor) from the pool, waiting up to DB_POOL_TIMEOUT seconds for one to be free.
+
+    Raises:
+        psycopg2.pool.PoolError: No connection was free in time.
+
+    """
+    if not db_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise pool.PoolError(f"No database connection was free after {DB_POOL_TIMEOUT} seconds")
+
     try:
-        yield conn, cur
+        connection_pool = get_pool()
+        conn = connection_pool.getconn()
+        try:
+            cur = conn.cursor()
+            try:
+                yield conn, cur
+            finally:
+                cur.close()
+        finally:
+            connection_pool.putconn(conn)
     finally:
-        cur.close()
-        db_pool.putconn(conn)
+        db_pool_slots.release()
 
 def setup():
     with db() as (conn, cur):
@@ -31,17 +92,25 @@ def setup():
         
         CREATE TABLE IF NOT EXISTS core.Default_Config (
             default_config_id SMALLSERIAL PRIMARY KEY,
-            config_key VARCHAR(30) NOT NULL,
+            config_key VARCHAR(100) NOT NULL,
             config_value VARCHAR NULL
         );
 
         CREATE TABLE IF NOT EXISTS core.Guild_Config (
             guild_config_id SERIAL PRIMARY KEY,
-            guild_id INTEGER NOT NULL,
-            config_key VARCHAR(30) NOT NULL,
+            guild_id BIGINT NOT NULL,
+            config_key VARCHAR(100) NOT NULL,
             config_value VARCHAR NULL
         );
 
+        -- Keys are dotted paths into the features config (e.g. "inactivity.days_threshold")
+        ALTER TABLE core.Default_Config ALTER COLUMN config_key TYPE VARCHAR(100);
+        ALTER TABLE core.Guild_Config
+            ALTER COLUMN guild_id TYPE BIGINT,
+            ALTER COLUMN config_key TYPE VARCHAR(100);
+        CREATE UNIQUE INDEX IF NOT EXISTS default_config_key ON core.Default_Config (config_key);
+        CREATE UNIQUE INDEX IF NOT EXISTS guild_config_key ON core.Guild_Config (guild_id, config_key);
+
         CREATE TABLE IF NOT EXISTS core.Permission (
             permission_id SMALLINT PRIMARY KEY,
             permission_name VARCHAR(32)
@@ -63,30 +132,195 @@ def setup():
         
         CREATE TABLE IF NOT EXISTS core.Inactive_Member (
             inactive_member_id SERIAL PRIMARY KEY,
-            guild_id INTEGER NOT NULL,
-            member_id INTEGER NOT NULL,
+            guild_id BIGINT NOT NULL,
+            member_id BIGINT NOT NULL,
             last_notified TIMESTAMPTZ NULL
         );
 
+        -- Discord IDs don't fit in INTEGER
+        ALTER TABLE core.Inactive_Member
+            ALTER COLUMN guild_id TYPE BIGINT,
+            ALTER COLUMN member_id TYPE BIGINT;
+
         CREATE TABLE IF NOT EXISTS core.Exemption (
             exempt_member_id SERIAL PRIMARY KEY,
             guild_id INTEGER NOT NULL,
             member_id INTEGER NOT NULL
         );
+
+        CREATE TABLE IF NOT EXISTS core.Member_Activity (
+            guild_id BIGINT NOT NULL,
+            member_id BIGINT NOT NULL,
+            last_seen TIMESTAMP NOT NULL,
+            PRIMARY KEY (guild_id, member_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS core.Member_Activity_Coverage (
+            guild_id BIGINT PRIMARY KEY,
+            tracked_since TIMESTAMP NOT NULL
+        );
+
+        -- Last time all of a guild's tracked activity had been saved (anything after may be missing)
+        ALTER TABLE core.Member_Activity_Coverage ADD COLUMN IF NOT EXISTS tracked_until TIMESTAMP NULL;
+
+        CREATE TABLE IF NOT EXISTS core.Scan_Checkpoint (
+            guild_id BIGINT NOT NULL,
+            time_boundary TIMESTAMP NOT NULL,
+            channel_id BIGINT NOT NULL,
+            last_message_id BIGINT NULL,
+            completed BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY (guild_id, time_boundary, channel_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS core.Scan_Checkpoint_Member (
+            guild_id BIGINT NOT NULL,
+            time_boundary TIMESTAMP NOT NULL,
+            member_id BIGINT NOT NULL,
+            last_seen TIMESTAMP NOT NULL,
+            PRIMARY KEY (guild_id, time_boundary, member_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS core.Notification_Outbox (
+            outbox_id SERIAL PRIMARY KEY,
+            guild_id BIGINT NOT NULL,
+            member_id BIGINT NOT NULL,
+            content VARCHAR NOT NULL,
+            use_case VARCHAR(30) NULL,
+            report_channel_id BIGINT NULL,
+            state VARCHAR(10) NOT NULL DEFAULT 'pending',
+            attempts SMALLINT NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC'),
+            last_error VARCHAR NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'UTC')
+        );
+
+        CREATE INDEX IF NOT EXISTS notification_outbox_pending
+            ON core.Notification_Outbox (guild_id, next_attempt_at) WHERE state = 'pending';
         """
         cur.execute(query)
         conn.commit()
 
-def add_config_record(key, value):
-    return
+def add_config_record(key, value, guild_id=None):
+    """Adds a config setting (stored as JSON).
 
-def get_config_value(key):
-    return
+    Args:
+        key(str): Dotted path of the setting in the features config (e.g. "inactivity.days_threshold").
+        value: New value of the setting.
+        guild_id(int): Guild ID according to Discord API (None for a default setting).
 
-def update_config_value(key, value):
-    return
+    Returns:
+        bool: True if the setting was added, otherwise False (e.g. it already exists).
+
+    """
+    with db() as (conn, cur):
+        try:
+            if guild_id is None:
+                query = "INSERT INTO core.Default_Config (config_key, config_value) VALUES (%s, %s)"
+                cur.execute(query, (key, json.dumps(value)))
+            else:
+                query = "INSERT INTO core.Guild_Config (guild_id, config_key, config_value) VALUES (%s, %s, %s)"
+                cur.execute(query, (guild_id, key, json.dumps(value)))
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+            return False
+
+    return True
+
+def get_config_value(key, guild_id=None):
+    """Gets a config setting.
+
+    Args:
+        key(str): Dotted path of the setting in the features config.
+        guild_id(int): Guild ID according to Discord API (None for a default setting).
+
+    Returns:
+        The setting's value (None if it isn't set).
+
+    """
+    result = None
+    with db() as (conn, cur):
+        if guild_id is None:
+            query = "SELECT config_value FROM core.Default_Config WHERE config_key = %s"
+            cur.execute(query, (key,))
+        else:
+            query = "SELECT config_value FROM core.Guild_Config WHERE guild_id = %s AND config_key = %s"
+            cur.execute(query, (guild_id, key))
+        result = cur.fetchone()
+
+    return json.loads(result[0]) if result and result[0] is not None else None
+
+def get_config_records(guild_id=None):
+    """Gets every config setting saved for a guild (or every default setting).
+
+    Args:
+        guild_id(int): Guild ID according to Discord API (None for default settings).
+
+    Returns:
+        dict: The settings {key: value}.
+
+    """
+    results = []
+    with db() as (conn, cur):
+        if guild_id is None:
+            cur.execute("SELECT config_key, config_value FROM core.Default_Config")
+        else:
+            query = "SELECT config_key, config_value FROM core.Guild_Config WHERE guild_id = %s"
+            cur.execute(query, (guild_id,))
+        results = cur.fetchall()
+
+    return {r[0]: json.loads(r[1]) if r[1] is not None else None for r in results}
+
+def update_config_value(key, value, guild_id=None):
+    """Updates a config setting.
+
+    Args:
+        key(str): Dotted path of the setting in the features config.
+        value: New value of the setting.
+        guild_id(int): Guild ID according to Discord API (None for a default setting).
+
+    Returns:
+        bool: True if the setting was updated, otherwise False (e.g. it doesn't exist yet).
+
+    """
+    with db() as (conn, cur):
+        try:
+            if guild_id is None:
+                query = "UPDATE core.Default_Config SET config_value = %s WHERE config_key = %s"
+                cur.execute(query, (json.dumps(value), key))
+            else:
+                query = "UPDATE core.Guild_Config SET config_value = %s WHERE guild_id = %s AND config_key = %s"
+                cur.execute(query, (json.dumps(value), guild_id, key))
+            updated = cur.rowcount > 0
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+            return False
+
+    return updated
+
+def delete_config_record(key, guild_id=None):
+    """Deletes a config setting, so the YAML config (or default setting) applies again.
+
+    Args:
+        key(str): Dotted path of the setting in the features config.
+        guild_id(int): Guild ID according to Discord API (None for a default setting).
+
+    """
+    with db() as (conn, cur):
+        try:
+            if guild_id is None:
+                cur.execute("DELETE FROM core.Default_Config WHERE config_key = %s", (key,))
+            else:
+                query = "DELETE FROM core.Guild_Config WHERE guild_id = %s AND config_key = %s"
+                cur.execute(query, (guild_id, key))
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
 
-def delete_config_record(key):
     return
 
 def get_all_inactive_members(guild_id):
@@ -99,12 +333,14 @@ def get_all_inactive_members(guild_id):
         dict: Dictionary of inactive members within specified guild {member_id: InactiveMember}.
 
     """
-    inactive_members = []
+    inactive_members = {}
     results = []
     with db() as (conn, cur):
-        query = sql.SQL("""SELECT guild_id, member_id, last_notified, is_exempt
-            FROM core.Inactive_Member WHERE guild_id = {}""".format(guild_id))
-        cur.execute(query)
+        query = """SELECT i.guild_id, i.member_id, i.last_notified, EXISTS (
+                SELECT 1 FROM core.Exemption e WHERE e.guild_id = i.guild_id AND e.member_id = i.member_id
+            ) AS is_exempt
+            FROM core.Inactive_Member i WHERE i.guild_id = %s"""
+        cur.execute(query, (guild_id,))
         results = cur.fetchall()
     
     if results:
@@ -115,7 +351,29 @@ def get_all_inactive_members(guild_id):
 def get_inactive_members(guild_id):
     return
 
-def update_inactive_member(guild_id, member_id, **kwargs):
+def update_inactive_member(guild_id, member_id, last_notified=None):
+    """Updates an inactive member record, adding it if it doesn't exist yet.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+        member_id(int): Member ID according to Discord API.
+        last_notified(datetime.datetime): Time the member was last notified of their inactivity.
+
+    """
+    with db() as (conn, cur):
+        try:
+            query = """UPDATE core.Inactive_Member SET last_notified = %s
+                WHERE guild_id = %s AND member_id = %s"""
+            cur.execute(query, (last_notified, guild_id, member_id))
+            if not cur.rowcount:
+                query = """INSERT INTO core.Inactive_Member
+                    (guild_id, member_id, last_notified) VALUES (%s, %s, %s)"""
+                cur.execute(query, (guild_id, member_id, last_notified))
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+
     return
 
 def add_inactive_member(guild_id, member_id):
@@ -205,3 +463,298 @@ def remove_exemption(guild_id, member_id):
             conn.rollback()
 
     return
+
+def get_member_activity(guild_id):
+    """Gets the last time each tracked member of a guild was active.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+
+    Returns:
+        dict: Last activity of members within specified guild {member_id: last_seen (UTC datetime)}.
+
+    """
+    results = []
+    with db() as (conn, cur):
+        query = """SELECT member_id, last_seen
+            FROM core.Member_Activity WHERE guild_id = %s"""
+        cur.execute(query, (guild_id,))
+        results = cur.fetchall()
+
+    return {r[0]: r[1] for r in results}
+
+def update_member_activity(records):
+    """Saves members' last activity, keeping whichever time is most recent.
+
+    Args:
+        records(list): Collection of (guild_id, member_id, last_seen) tuples.
+
+    Returns:
+        bool: True if the records were saved, otherwise False.
+
+    """
+    with db() as (conn, cur):
+        try:
+            query = """INSERT INTO core.Member_Activity (guild_id, member_id, last_seen) VALUES %s
+                ON CONFLICT (guild_id, member_id) DO UPDATE
+                SET last_seen = GREATEST(core.Member_Activity.last_seen, EXCLUDED.last_seen)"""
+            execute_values(cur, query, records)
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+            return False
+
+    return True
+
+def get_activity_coverage(guild_id):
+    """Gets the time span over which a guild's member activity has been tracked.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+
+    Returns:
+        tuple: UTC times (tracked_since, tracked_until), or (None, None) if the guild isn't tracked.
+            tracked_until is the last time all activity was saved, so activity after it may be missing.
+
+    """
+    result = None
+    with db() as (conn, cur):
+        query = """SELECT tracked_since, tracked_until
+            FROM core.Member_Activity_Coverage WHERE guild_id = %s"""
+        cur.execute(query, (guild_id,))
+        result = cur.fetchone()
+
+    return (result[0], result[1]) if result else (None, None)
+
+def update_activity_coverage(records):
+    """Sets the time spans over which guilds' member activity has been tracked.
+
+    Args:
+        records(list): Collection of (guild_id, tracked_since, tracked_until) tuples.
+
+    Returns:
+        bool: True if the coverage was saved, otherwise False.
+
+    """
+    with db() as (conn, cur):
+        try:
+            query = """INSERT INTO core.Member_Activity_Coverage (guild_id, tracked_since, tracked_until) VALUES %s
+                ON CONFLICT (guild_id) DO UPDATE
+                SET tracked_since = EXCLUDED.tracked_since, tracked_until = EXCLUDED.tracked_until"""
+            execute_values(cur, query, records)
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+            return False
+
+    return True
+
+def get_scan_checkpoint_boundary(guild_id, earliest, latest):
+    """Gets the time boundary of a guild's most recent activity scan checkpoint within a range.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+        earliest(datetime.datetime): Earliest time boundary to look for (UTC).
+        latest(datetime.datetime): Latest time boundary to look for (UTC).
+
+    Returns:
+        datetime.datetime: Time boundary of the checkpoint, or None if there isn't one.
+
+    """
+    result = None
+    with db() as (conn, cur):
+        query = """SELECT MAX(time_boundary) FROM core.Scan_Checkpoint
+            WHERE guild_id = %s AND time_boundary BETWEEN %s AND %s"""
+        cur.execute(query, (guild_id, earliest, latest))
+        result = cur.fetchone()
+
+    return result[0] if result else None
+
+def get_scan_checkpoint(guild_id, time_boundary):
+    """Gets the saved progress of a guild's activity scan.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+        time_boundary(datetime.datetime): Time boundary (UTC) the scan was started with.
+
+    Returns:
+        tuple: ({channel_id: last_message_id}, {completed channel IDs}, {member_id: last_seen})
+
+    """
+    channels = []
+    members = []
+    with db() as (conn, cur):
+        query = """SELECT channel_id, last_message_id, completed FROM core.Scan_Checkpoint
+            WHERE guild_id = %s AND time_boundary = %s"""
+        cur.execute(query, (guild_id, time_boundary))
+        channels = cur.fetchall()
+
+        query = """SELECT member_id, last_seen FROM core.Scan_Checkpoint_Member
+            WHERE guild_id = %s AND time_boundary = %s"""
+        cur.execute(query, (guild_id, time_boundary))
+        members = cur.fetchall()
+
+    positions = {c[0]: c[1] for c in channels if c[1]}
+    completed = {c[0] for c in channels if c[2]}
+    last_seen = {m[0]: m[1] for m in members}
+    return positions, completed, last_seen
+
+def save_scan_checkpoint(guild_id, time_boundary, channels, members):
+    """Saves the progress of a guild's activity scan in a single transaction.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+        time_boundary(datetime.datetime): Time boundary (UTC) the scan was started with.
+        channels(list): Collection of (channel_id, last_message_id, completed) tuples.
+        members(list): Collection of (member_id, last_seen) tuples seen since the last save.
+
+    Returns:
+        bool: True if the checkpoint was saved, otherwise False.
+
+    """
+    with db() as (conn, cur):
+        try:
+            if channels:
+                query = """INSERT INTO core.Scan_Checkpoint
+                    (guild_id, time_boundary, channel_id, last_message_id, completed) VALUES %s
+                    ON CONFLICT (guild_id, time_boundary, channel_id) DO UPDATE
+                    SET last_message_id = EXCLUDED.last_message_id, completed = EXCLUDED.completed"""
+                execute_values(cur, query, [(guild_id, time_boundary) + c for c in channels])
+            if members:
+                query = """INSERT INTO core.Scan_Checkpoint_Member
+                    (guild_id, time_boundary, member_id, last_seen) VALUES %s
+                    ON CONFLICT (guild_id, time_boundary, member_id) DO UPDATE
+                    SET last_seen = GREATEST(core.Scan_Checkpoint_Member.last_seen, EXCLUDED.last_seen)"""
+                execute_values(cur, query, [(guild_id, time_boundary) + m for m in members])
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+            return False
+
+    return True
+
+def delete_scan_checkpoints(guild_id, latest):
+    """Deletes a guild's activity scan checkpoints with a time boundary up to a given time.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+        latest(datetime.datetime): Latest time boundary (UTC) of checkpoints to delete.
+
+    """
+    with db() as (conn, cur):
+        try:
+            for table in ("core.Scan_Checkpoint", "core.Scan_Checkpoint_Member"):
+                query = sql.SQL("DELETE FROM {} WHERE guild_id = %s AND time_boundary <= %s").format(
+                    sql.SQL(table)
+                )
+                cur.execute(query, (guild_id, latest))
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+
+    return
+
+def add_outbox_entries(guild_id, use_case, report_channel_id, notices):
+    """Queues notices to be sent to members.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+        use_case(str): What the notices are for (e.g. "inactivity").
+        report_channel_id(int): ID of the channel to report delivery results in.
+        notices(list): Collection of (member_id, content) tuples.
+
+    Returns:
+        list: The queued notices (OutboxEntry), in the same order.
+
+    """
+    results = []
+    with db() as (conn, cur):
+        query = """INSERT INTO core.Notification_Outbox
+            (guild_id, member_id, content, use_case, report_channel_id) VALUES %s
+            RETURNING outbox_id, member_id, content, next_attempt_at"""
+        results = execute_values(
+            cur, query, [(guild_id, m, c, use_case, report_channel_id) for m, c in notices], fetch=True
+        )
+        conn.commit()
+
+    return [
+        OutboxEntry(r[0], guild_id, r[1], r[2], use_case, report_channel_id, next_attempt_at=r[3])
+        for r in results
+    ]
+
+def get_pending_outbox_entries(guild_id):
+    """Gets the notices within a guild that haven't been delivered or given up on yet.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+
+    Returns:
+        list: Pending notices (OutboxEntry), oldest first.
+
+    """
+    results = []
+    with db() as (conn, cur):
+        query = """SELECT outbox_id, member_id, content, use_case, report_channel_id, attempts, next_attempt_at
+            FROM core.Notification_Outbox WHERE guild_id = %s AND state = 'pending'
+            ORDER BY outbox_id"""
+        cur.execute(query, (guild_id,))
+        results = cur.fetchall()
+
+    return [
+        OutboxEntry(r[0], guild_id, r[1], r[2], r[3], r[4], attempts=r[5], next_attempt_at=r[6])
+        for r in results
+    ]
+
+def update_outbox_entry(entry):
+    """Saves the delivery state of a queued notice.
+
+    Args:
+        entry(OutboxEntry): Notice to save.
+
+    Returns:
+        bool: True if the state was saved, otherwise False.
+
+    """
+    with db() as (conn, cur):
+        try:
+            query = """UPDATE core.Notification_Outbox
+                SET state = %s, attempts = %s, next_attempt_at = %s, last_error = %s
+                WHERE outbox_id = %s"""
+            cur.execute(query, (entry.state, entry.attempts, entry.next_attempt_at, entry.last_error, entry.outbox_id))
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+            return False
+
+    return True
+
+def expire_outbox_entries(guild_id, queued_before):
+    """Gives up on a guild's pending notices that were queued before a given time.
+
+    Args:
+        guild_id(int): Guild ID according to Discord API.
+        queued_before(datetime.datetime): UTC time that notices queued earlier are too old to send.
+
+    Returns:
+        int: Number of notices given up on.
+
+    """
+    with db() as (conn, cur):
+        try:
+            query = """UPDATE core.Notification_Outbox
+                SET state = 'expired', last_error = 'Too old to send.'
+                WHERE guild_id = %s AND state = 'pending' AND created_at < %s"""
+            cur.execute(query, (guild_id, queued_before))
+            expired = cur.rowcount
+            conn.commit()
+        except psycopg2.DatabaseError as e:
+            print(e.diag.message_primary)
+            conn.rollback()
+            return 0
+
+    return expired
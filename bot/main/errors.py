@@ -22,3 +22,4 @@ class ErrorCode(Enum):
     ERR_INVALID_ERRCODE = auto()
     ERR_FEATURE_DISABLED = auto()
     ERR_FEATURE_NOT_FOUND = auto()
+    ERR_INVALID_CONFIG = auto()
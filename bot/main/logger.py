@@ -1,9 +1,30 @@
+import atexit
+import collections
+import copy
 import logging
+import logging.handlers
+import queue
+import threading
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 class Logger(object):
+    """Logs through a logging.Logger, skipping any work for records that won't be logged.
+
+    msg can be a callable returning the message, so it's only built if the record is logged.
+    Records passed with sampled=True (e.g. the content of every message) are only kept at their
+    logger's sample rate (see `set_sample_rate`).
+
+    Attributes:
+        counters (collections.Counter): Records per (logger name, outcome), where outcome is
+            "logged", "filtered" (level disabled), "sampled_out" or "dropped" (see QueueLogging).
+
+    """
+    counters = collections.Counter()
+    _sample_every = {}  # {logger name: keep 1 in every n sampled records}
+    _sample_seen = collections.Counter()
+
     @classmethod
     def debug(cls, log_object, msg, *args, **kwargs):
         cls._log(log_object, logging.DEBUG, msg, *args, **kwargs)
@@ -25,17 +46,171 @@ class Logger(object):
         cls._log(log_object, logging.CRITICAL, msg, *args, **kwargs)
 
     @classmethod
-    def _log(cls, log_object, log_level, message, *args, **kwargs):
-        log_map = {
-            logging.DEBUG: log_object.debug,
-            logging.INFO: log_object.info,
-            logging.WARN: log_object.warn,
-            logging.ERROR: log_object.error,
-            logging.CRITICAL: log_object.critical,
-        }
+    def set_sample_rate(cls, log_object, rate: float):
+        """Sets the share (0 to 1) of a logger's sampled records to keep (1 keeps them all)."""
+        if rate >= 1:
+            cls._sample_every.pop(log_object.name, None)
+        else:
+            cls._sample_every[log_object.name] = round(1 / rate) if rate > 0 else 0
+
+    @classmethod
+    def stats(cls) -> dict:
+        """Returns how many records each logger has had per outcome {logger name: {outcome: count}}."""
+        stats = {}
+        for (name, outcome), count in cls.counters.items():
+            stats.setdefault(name, {})[outcome] = count
+        return stats
+
+    @classmethod
+    def _log(cls, log_object, log_level, message, *args, sampled=False, **kwargs):
         try:
-            log_map[log_level](message, *args, **kwargs)
-        except UnicodeEncodeError:
-            log_map[log_level](message.encode("utf-8", errors="replace"), *args, **kwargs)
+            name = log_object.name
+            if not log_object.isEnabledFor(log_level):
+                cls.counters[(name, "filtered")] += 1
+                return
         except AttributeError as invalid_arg_err:
             logger.error(invalid_arg_err)
+            return
+
+        if sampled and name in cls._sample_every:
+            every = cls._sample_every[name]
+            cls._sample_seen[name] += 1
+            if not every or cls._sample_seen[name] % every:
+                cls.counters[(name, "sampled_out")] += 1
+                return
+
+        if callable(message):
+            message = message()
+
+        cls.counters[(name, "logged")] += 1
+        try:
+            log_object.log(log_level, message, *args, **kwargs)
+        except UnicodeEncodeError:
+            log_object.log(log_level, message.encode("utf-8", errors="replace"), *args, **kwargs)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Hands log records to a background thread, dropping or blocking when its queue is full.
+
+    Only the message is interpolated here; formatting and I/O happen in the listener's thread.
+
+    Attributes:
+        route (str): Name of the logger this handler was attached to (see QueueLogging).
+        drop_policy (str): "drop_oldest" or "drop_newest" to discard a record when the queue
+            is full, or "block" to wait for room.
+        dropped (int): Records discarded since the last drop was reported.
+
+    """
+    def __init__(self, log_queue, route, drop_policy="drop_oldest"):
+        super().__init__(log_queue)
+        self.route = route
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # The same record can reach several queued loggers as it propagates, so tag a copy
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.queue_route = self.route
+        return record
+
+    def enqueue(self, record):
+        if self.drop_policy == "block":
+            self.queue.put(record)
+            return
+
+        with self._lock:
+            if self.dropped:
+                self._report_dropped()
+
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                if self.drop_policy == "drop_oldest":
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.put_nowait(record)
+                    except (queue.Empty, queue.Full):
+                        pass
+                self.dropped += 1
+                Logger.counters[(self.route, "dropped")] += 1
+
+    def _report_dropped(self):
+        notice = logging.LogRecord(
+            self.route, logging.WARN, __file__, 0, f"Dropped {self.dropped} log records (queue was full)", None, None
+        )
+        notice.queue_route = self.route
+        try:
+            self.queue.put_nowait(notice)
+        except queue.Full:
+            return
+        self.dropped = 0
+
+
+class RoutingQueueListener(logging.handlers.QueueListener):
+    """Passes each queued record to the handlers of the logger that queued it."""
+    def __init__(self, log_queue, routes):
+        super().__init__(log_queue, respect_handler_level=True)
+        self.routes = routes  # {logger name: [logging.Handler]}
+
+    def enqueue_sentinel(self):
+        # Wait for room rather than fail when stopping with a full queue
+        self.queue.put(self._sentinel)
+
+    def handle(self, record):
+        for handler in self.routes.get(getattr(record, "queue_route", None), ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class QueueLogging():
+    """Moves the handlers of chosen loggers onto a background thread.
+
+    Set up from the 'queue' section of logging.yaml, e.g.
+        queue:
+          enabled: true
+          max_size: 10000
+          drop_policy: drop_oldest
+          loggers: [main.bot]
+
+    """
+    listener = None
+    _handlers = {}  # {logger name: original handlers}
+
+    @classmethod
+    def start(cls, settings: dict):
+        if cls.listener or not settings or not settings.get("enabled"):
+            return
+
+        log_queue = queue.Queue(maxsize=settings.get("max_size", 10000))
+        drop_policy = settings.get("drop_policy", "drop_oldest")
+        for name in settings.get("loggers", []):
+            queued_logger = logging.getLogger(name)
+            cls._handlers[name] = list(queued_logger.handlers)
+            for handler in cls._handlers[name]:
+                queued_logger.removeHandler(handler)
+            queued_logger.addHandler(BoundedQueueHandler(log_queue, name, drop_policy))
+
+        cls.listener = RoutingQueueListener(log_queue, cls._handlers)
+        cls.listener.start()
+        atexit.register(cls.stop)
+
+    @classmethod
+    def stop(cls):
+        """Writes any queued records, then puts each logger's handlers back in place."""
+        if not cls.listener:
+            return
+
+        listener, cls.listener = cls.listener, None
+        for name, handlers in cls._handlers.items():
+            queued_logger = logging.getLogger(name)
+            for handler in [h for h in queued_logger.handlers if isinstance(h, BoundedQueueHandler)]:
+                queued_logger.removeHandler(handler)
+            for handler in handlers:
+                queued_logger.addHandler(handler)
+
+        # Waits for the listener to handle everything queued before it
+        listener.stop()
+        cls._handlers = {}
@@ -0,0 +1,95 @@
+"""Server features that act on member updates (see the 'on_member_update' section of the features config).
+
+Each server's milestone roles are indexed once per config, with their output channels resolved
+ahead of time, so most member updates (nicknames, statuses, etc.) are turned away straight off.
+"""
+import collections
+import logging
+
+import discord
+
+from main import utils
+from main.logger import Logger
+from main.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class RoleMilestone():
+    """A message sent to a channel when a member is given a role.
+
+    Attributes:
+        channel_id (int): ID of the channel the message is sent to (None if no channel has the configured name).
+        message (str): Message to send (placeholders are substituted, see `utils.substitute_text`).
+
+    """
+    def __init__(self, channel_id: int, message: str):
+        self.channel_id = channel_id
+        self.message = message
+
+
+class RoleMilestoneIndex():
+    """A server's milestone roles.
+
+    Attributes:
+        milestones (dict): RoleMilestone for each role ID, in config order.
+
+    """
+    def __init__(self, server: discord.Guild, role_message_config):
+        self.milestones = {}
+        if not role_message_config or not role_message_config.get("enabled"):
+            return
+
+        for role_id, settings in (role_message_config.get("roles") or {}).items():
+            channel = utils.channel_names.get(server, settings["channel"])
+            self.milestones[role_id] = RoleMilestone(channel.id if channel else None, settings["message"])
+
+    def reached(self, added_role_ids: set) -> list:
+        """Returns the milestones (RoleMilestone) for the given newly added roles, in config order."""
+        if len(added_role_ids) == 1:
+            milestone = self.milestones.get(next(iter(added_role_ids)))
+            return [milestone] if milestone else []
+
+        return [m for role_id, m in self.milestones.items() if role_id in added_role_ids]
+
+    async def announce(self, member: discord.Member, added_role_ids: set):
+        """Sends the message for each milestone role a member was just given."""
+        for milestone in self.reached(added_role_ids):
+            output_channel = member.guild.get_channel(milestone.channel_id) if milestone.channel_id else None
+            if not output_channel:
+                Logger.warn(logger, f"No channel to announce {member.name}'s new role in ({member.guild.name}).")
+                continue
+
+            await utils.say(output_channel, context=member, parse=True, content=milestone.message)
+
+
+class RoleMilestoneCache():
+    """Milestone index for each server, rebuilt whenever the server's config or channels change.
+
+    Attributes:
+        max_size (int): Most servers to keep indexes for. The least recently used is dropped first.
+
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._indexes = collections.OrderedDict()  # {server_id: (server config, RoleMilestoneIndex)}
+
+    def get(self, server: discord.Guild, server_config) -> RoleMilestoneIndex:
+        cached = self._indexes.get(server.id)
+        if cached and cached[0] is server_config:
+            self._indexes.move_to_end(server.id)
+            return cached[1]
+
+        index = RoleMilestoneIndex(server, server_config.on_member_update.get("role_message"))
+        self._indexes[server.id] = (server_config, index)
+        self._indexes.move_to_end(server.id)
+        while len(self._indexes) > self.max_size:
+            self._indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, server_id: int):
+        """Drops a server's index (e.g. after a channel is renamed or the bot leaves the server)."""
+        self._indexes.pop(server_id, None)
+
+
+role_milestones = RoleMilestoneCache(max_size=Settings.app_defaults("server_config_cache_size") or 1000)
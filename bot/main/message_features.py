@@ -0,0 +1,174 @@
+"""Server features that act on messages (see the 'on_message' section of the features config).
+
+Each server's enabled features are compiled once per config into a chain of handlers, with
+patterns and channel lookups prepared ahead of time, so handling a message only does the work
+its server actually needs.
+"""
+import bisect
+import collections
+import logging
+import re
+
+import discord
+
+from main import utils
+from main.logger import Logger
+from main.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class Mee6LevelUp():
+    """Gives members the level roles they've earned when MEE6 announces that they levelled up.
+
+    Attributes:
+        levels (list): Levels that give a role, in ascending order.
+        role_ids (list): ID of the role given at each level in `levels`.
+
+    """
+    MENTION = re.compile(r"<@!?([0-9]+)>")
+
+    def __init__(self, settings):
+        self.bot_id = settings["bot_id"]
+        self.pattern = re.compile(settings["message_pattern"])
+        roles = sorted((settings.get("roles") or {}).items())
+        self.levels = [level for level, _ in roles]
+        self.role_ids = [role["id"] for _, role in roles]
+
+    def applies(self, message) -> bool:
+        return message.author.id == self.bot_id
+
+    def missing_roles(self, member: discord.Member, level: int) -> list:
+        """Returns the level roles (discord.Role) a member has earned but doesn't have yet."""
+        earned = self.role_ids[:bisect.bisect_right(self.levels, level)]
+        if not earned:
+            return []
+
+        current = {r.id for r in member.roles}
+        roles = (member.guild.get_role(role_id) for role_id in earned if role_id not in current)
+        return [r for r in roles if r]
+
+    async def reconcile(self, member: discord.Member, level: int) -> list:
+        """Gives a member every level role they're missing in a single edit.
+
+        Returns:
+            list: The roles (discord.Role) added.
+
+        """
+        missing = self.missing_roles(member, level)
+        if missing:
+            await member.add_roles(*missing, reason=f"User reached level {level}", atomic=False)
+        return missing
+
+    async def handle(self, message) -> bool:
+        result = self.pattern.search(message.content)
+        if result:
+            # Take the member mentioned in the level-up announcement itself
+            mentioned = None
+            mention = self.MENTION.search(result.group(0))
+            if mention:
+                mentioned = message.guild.get_member(int(mention.group(1)))
+            if not mentioned and message.mentions:
+                mentioned = message.mentions[0]
+            if not mentioned:
+                return False
+
+            level = int(result.group(1))
+            Logger.info(logger, f"{mentioned.name} reached level {level}")
+            await self.reconcile(mentioned, level)
+
+        return False
+
+
+class PicsOnly():
+    """Deletes messages without attachments in picture-only channels and tells the author why."""
+    def __init__(self, settings):
+        self.channel_messages = {
+            channel_id: channel_settings["message"]
+            for channel_id, channel_settings in (settings.get("channels") or {}).items()
+        }
+
+    def applies(self, message) -> bool:
+        return message.channel.id in self.channel_messages and not message.attachments
+
+    async def handle(self, message) -> bool:
+        content = message.clean_content
+        try:
+            await message.delete()
+        except (discord.Forbidden, discord.HTTPException) as e:
+            Logger.warn(logger, f"Unable to delete message at {message.jump_url}. {e}")
+            return False
+
+        custom_message = self.channel_messages[message.channel.id]
+        await utils.say(
+            message.author, context=message, parse=True, content=f"{custom_message}\nYour message: ```{content}```"
+        )
+        return True
+
+
+# Features in the order they handle messages
+FEATURES = (
+    ("mee6_level_up", Mee6LevelUp),
+    ("pics_only", PicsOnly),
+)
+
+
+class MessageHandlerChain():
+    """A server's enabled message features.
+
+    Attributes:
+        handlers (tuple): Feature handlers, in the order they handle messages.
+
+    """
+    def __init__(self, on_message_config):
+        handlers = []
+        for name, feature in FEATURES:
+            settings = on_message_config.get(name)
+            if settings and settings.get("enabled"):
+                handlers.append(feature(settings))
+        self.handlers = tuple(handlers)
+
+    async def handle(self, message) -> bool:
+        """Passes a message through each feature that applies to it.
+
+        Returns:
+            bool: True if a feature consumed the message (so it shouldn't be processed further).
+
+        """
+        for handler in self.handlers:
+            if handler.applies(message) and await handler.handle(message):
+                return True
+
+        return False
+
+
+class MessageHandlerCache():
+    """Compiled handler chain for each server, rebuilt whenever the server's config changes.
+
+    Attributes:
+        max_size (int): Most servers to keep chains for. The least recently used is dropped first.
+
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._chains = collections.OrderedDict()  # {server_id: (server config, MessageHandlerChain)}
+
+    def get(self, server_id: int, server_config) -> MessageHandlerChain:
+        cached = self._chains.get(server_id)
+        if cached and cached[0] is server_config:
+            self._chains.move_to_end(server_id)
+            return cached[1]
+
+        chain = MessageHandlerChain(server_config.on_message)
+        self._chains[server_id] = (server_config, chain)
+        self._chains.move_to_end(server_id)
+        while len(self._chains) > self.max_size:
+            self._chains.popitem(last=False)
+        return chain
+
+    def invalidate(self, server_id: int):
+        """Drops a server's chain (e.g. after the bot leaves the server)."""
+        self._chains.pop(server_id, None)
+
+
+message_handlers = MessageHandlerCache(max_size=Settings.app_defaults("server_config_cache_size") or 1000)
@@ -1,26 +1,369 @@
+import asyncio
+import collections
+import collections.abc
+import copy
+import hashlib
 import logging
 import os
+import pickle
+import re
+import time
 from pathlib import Path
 import yaml
+from main.errors import AppError, ErrorCode
 from main.logger import Logger
 
 logger = logging.getLogger(__name__)
 
+# Bump when the structure of cached snapshots changes so old ones are rebuilt (changes to this
+# module, which builds them, already rebuild them)
+SNAPSHOT_VERSION = 1
+
+# Feature sections resolved for each server
+EVENT_FEATURES = ("on_message", "on_member_update")
+MERGED_FEATURES = ("inactivity", "commands")
+
+
+class FrozenConfig(collections.abc.Mapping):
+    """Read-only config values, also readable as attributes (e.g. config.inactivity.days_threshold).
+
+    Nested dicts are frozen too, and lists become tuples.
+    """
+    __slots__ = ("_values",)
+
+    def __init__(self, values=None):
+        object.__setattr__(self, "_values", {k: freeze(v) for k, v in (values or {}).items()})
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config is read-only")
+
+    def __repr__(self):
+        return f"FrozenConfig({self._values!r})"
+
+    def __reduce__(self):
+        return (FrozenConfig, (self._values,))
+
+
+def freeze(value):
+    """Returns a read-only copy of a config value."""
+    if isinstance(value, collections.abc.Mapping):
+        return value if isinstance(value, FrozenConfig) else FrozenConfig(value)
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+
+    return value
+
+def resolve_server_config(default_features, server_features):
+    """Combines a server's feature settings with the defaults.
+
+    Event features (e.g. on_message) only apply to a server that configures them, with any
+    missing settings taken from the defaults. Inactivity settings and each command's settings
+    fall back to the defaults setting by setting.
+
+    Args:
+        default_features(dict): Default features configuration.
+        server_features(dict): The server's features configuration (None if it has none).
+
+    Returns:
+        FrozenConfig: The server's resolved configuration.
+
+    """
+    server_features = server_features or {}
+    resolved = {}
+    for section in EVENT_FEATURES:
+        defaults = default_features.get(section) or {}
+        resolved[section] = {
+            feature: {**(defaults.get(feature) or {}), **settings}
+            for feature, settings in (server_features.get(section) or {}).items() if settings
+        }
+
+    defaults = default_features.get("inactivity") or {}
+    resolved["inactivity"] = {**defaults, **(server_features.get("inactivity") or {})}
+
+    defaults = default_features.get("commands") or {}
+    server_commands = server_features.get("commands") or {}
+    resolved["commands"] = {
+        command: {**(defaults.get(command) or {}), **(server_commands.get(command) or {})}
+        for command in {*defaults, *server_commands}
+    }
+
+    return FrozenConfig(resolved)
+
+def apply_overrides(features, overrides):
+    """Returns a copy of features config with settings replaced by overrides.
+
+    Args:
+        features(dict): Features configuration (e.g. a server's section of features.yaml).
+        overrides(dict): Settings to replace {dotted path: value}, e.g. {"inactivity.days_threshold": 30}.
+
+    """
+    features = copy.deepcopy(features) if features else {}
+    for key, value in overrides.items():
+        # Numeric keys (e.g. role and channel IDs) are numbers in the YAML config too
+        *path, name = [int(k) if k.isdigit() else k for k in key.split(".")]
+        section = features
+        for k in path:
+            if not isinstance(section.get(k), dict):
+                section[k] = {}
+            section = section[k]
+        section[name] = value
+
+    return features
+
+
+class ServerConfigCache():
+    """Bounded LRU cache of resolved server configs that include settings saved in the database.
+
+    Requests for a config that's still being loaded wait for that load instead of starting another.
+
+    Attributes:
+        max_size (int): Most server configs to keep. The least recently used is dropped first.
+        generation (int): Incremented on every invalidation, so loads that started before one
+            can tell their result is stale.
+        default_features (dict): Default features config with the default settings saved in the
+            database applied (None until loaded), shared by every server's config.
+        retry_seconds (int): How long to stop querying the database for a config after a load fails.
+
+    """
+    def __init__(self, max_size=1000, retry_seconds=30):
+        self.max_size = max_size
+        self.retry_seconds = retry_seconds
+        self.generation = 0
+        self.default_features = None
+        self._configs = collections.OrderedDict()
+        self._loads = {}  # {key: asyncio.Future}
+        self._failed_until = {}  # {key: time.monotonic() to retry loading from}
+
+    def __contains__(self, server_id):
+        return server_id in self._configs
+
+    def get(self, server_id):
+        """Returns a server's cached config (None if it isn't cached)."""
+        config = self._configs.get(server_id)
+        if config is not None:
+            self._configs.move_to_end(server_id)
+        return config
+
+    def put(self, server_id, config, generation):
+        """Caches a server's config, unless it was loaded before the last invalidation."""
+        if generation != self.generation:
+            return
+        self._configs[server_id] = config
+        self._configs.move_to_end(server_id)
+        while len(self._configs) > self.max_size:
+            self._configs.popitem(last=False)
+
+    def put_default_features(self, default_features, generation):
+        """Caches the default features config, unless it was loaded before the last invalidation."""
+        if generation == self.generation:
+            self.default_features = default_features
+
+    def invalidate(self, server_id=None):
+        """Drops a server's cached config (or every server's, if server_id is None)."""
+        self.generation += 1
+        if server_id is None:
+            self._configs.clear()
+            self._failed_until.clear()
+            self.default_features = None
+        else:
+            self._configs.pop(server_id, None)
+            self._failed_until.pop(server_id, None)
+
+    def is_failing(self, key) -> bool:
+        """Returns True if loading the key failed recently (see `retry_seconds`)."""
+        failed_until = self._failed_until.get(key)
+        if failed_until is None:
+            return False
+        if time.monotonic() < failed_until:
+            return True
+
+        del self._failed_until[key]
+        return False
+
+    async def load(self, key, load):
+        """Runs load(), sharing its result with every other request for the key while it runs.
+
+        If load() raises, the key is marked as failing for `retry_seconds` before the error is raised.
+        """
+        task = self._loads.get(key)
+        if not task:
+            task = asyncio.ensure_future(self._load(key, load))
+            self._loads[key] = task
+
+        # Shielded so one requester being cancelled doesn't cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key, load):
+        try:
+            return await load()
+        except Exception:
+            self._failed_until[key] = time.monotonic() + self.retry_seconds
+            raise
+        finally:
+            self._loads.pop(key, None)
+
+
+def validate_config(config):
+    """Checks that config has every required section and valid values.
+
+    Raises:
+        AppError: The config is invalid.
+
+    """
+    def require(section, values, name):
+        if not isinstance(values, dict):
+            raise AppError(ErrorCode.ERR_INVALID_CONFIG, f"'{name}' section is missing from {section} config")
+
+    require("app", config["app"], "app")
+    require("app", config["app"].get("default"), "default")
+    require("app", config["app"].get("standards"), "standards")
+    require("features", config["features"], "features")
+    require("features", config["features"].get("default"), "default")
+
+    for server_id, server_features in (config["features"].get("servers") or {}).items():
+        if not isinstance(server_id, int):
+            raise AppError(ErrorCode.ERR_INVALID_CONFIG, f"Server ID '{server_id}' isn't a number")
+        require("features", server_features, f"servers: {server_id}")
+
+        for feature, settings in ((server_features or {}).get("on_message") or {}).items():
+            pattern = (settings or {}).get("message_pattern")
+            if pattern:
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise AppError(ErrorCode.ERR_INVALID_CONFIG, f"Invalid pattern for {server_id}: {feature}. {e}")
+
+    check_command_names(config["features"]["default"].get("commands") or {})
+
+def check_command_names(commands_config, registered=()):
+    """Checks that no two commands would share a name or alias once commands_config is applied.
+
+    Args:
+        commands_config(dict): Settings of each command {command name: settings}, as in the features config.
+        registered(iterable): (name, aliases) of each registered command. Those without settings
+            in commands_config keep their current aliases.
+
+    Raises:
+        AppError: A name or alias would be used more than once.
+
+    """
+    configured = {name: settings for name, settings in commands_config.items() if settings}
+    commands = [(name, settings.get("aliases") or []) for name, settings in configured.items()]
+    commands.extend((name, aliases) for name, aliases in registered if name not in configured)
+
+    owners = {}
+    for name, aliases in commands:
+        for alias in [name, *aliases]:
+            if alias in owners:
+                raise AppError(
+                    ErrorCode.ERR_INVALID_CONFIG, f"'{alias}' is used more than once (by '{owners[alias]}' and '{name}')"
+                )
+            owners[alias] = name
+
+def config_changes(before, after, path=""):
+    """Yields a summary of each setting added, removed or changed between two versions of config."""
+    if isinstance(before, dict) and isinstance(after, dict):
+        for key in after:
+            if key not in before:
+                yield f"added {path}.{key}"
+            else:
+                yield from config_changes(before[key], after[key], f"{path}.{key}")
+        for key in before:
+            if key not in after:
+                yield f"removed {path}.{key}"
+    elif before != after:
+        yield f"changed {path}"
+
+def load_snapshot(name, sources, build):
+    """Returns the result of parsing config files, reusing a cached copy while the files are unchanged.
+
+    The result is pickled to a __pycache__ folder beside the first source file, keyed by a hash
+    of every source file's contents and of this module's code (which validates and resolves them).
+    It's rebuilt whenever any of them changes.
+
+    Args:
+        name(str): Name of the snapshot (used for its file name).
+        sources(list): Paths (Path) of the files the result is built from.
+        build(callable): Parses the files, returning the result to cache.
+
+    """
+    digest = hashlib.sha256(str(SNAPSHOT_VERSION).encode())
+    for source in [__file__, *sources]:
+        with open(source, "rb") as f:
+            digest.update(f.read())
+    key = digest.hexdigest()
+
+    cache_path = Path(sources[0]).parent.joinpath("__pycache__", f"{name}.pickle")
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, value = pickle.load(f)
+        if cached_key == key:
+            return value
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        Logger.debug(logger, lambda: f"Ignoring unreadable config snapshot {cache_path}: {e}")
+
+    value = build()
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        Logger.debug(logger, lambda: f"Couldn't save config snapshot {cache_path}: {e}")
+
+    return value
+
+
 class Settings():
     """Class for accessing values from config files"""
     config = {}
+    default_server_config = FrozenConfig()
+    server_configs = {}
+    server_config_cache = ServerConfigCache()
 
     @staticmethod
-    def load_config(filename):
-        with open(Path(__file__).parent.joinpath("config", filename), "r") as f:
+    def config_path(filename):
+        return Path(__file__).parent.joinpath("config", filename)
+
+    @classmethod
+    def load_config(cls, filename):
+        with open(cls.config_path(filename), "r") as f:
             return yaml.safe_load(f.read())
 
     @classmethod
-    def load_all(cls):
+    def read_all(cls):
+        """Reads and validates every config file without applying it (safe to run off the event loop).
+
+        Returns:
+            tuple: (config, default server config, {server_id: server config}) ready for `apply`.
+
+        Raises:
+            AppError: The config is missing a required section or has an invalid value.
+            yaml.YAMLError: A config file couldn't be parsed.
+
+        """
         app_config_filename = ""
         features_config_filename = ""
 
-        cls.config = {
+        config = {
             "app": {},
             "features": {},
             "env": {
@@ -33,7 +376,7 @@ class Settings():
             }
         }
 
-        app_environment = cls.config["env"]["environment"]
+        app_environment = config["env"]["environment"]
         if app_environment == "PROD":
             app_config_filename = "app.yaml"
             features_config_filename = "features.yaml"
@@ -41,8 +384,194 @@ class Settings():
             app_config_filename = "app_dev.yaml"
             features_config_filename = "features_dev.yaml"
 
-        cls.config["app"] = cls.load_config(app_config_filename)
-        cls.config["features"] = cls.load_config(features_config_filename)
+        def build():
+            files = {
+                "app": cls.load_config(app_config_filename),
+                "features": cls.load_config(features_config_filename),
+            }
+            validate_config({**config, **files})
+            return files, cls.resolve_server_configs(files["features"])
+
+        # Environment variables (e.g. secrets) are read fresh and never cached
+        files, (default_server_config, server_configs) = load_snapshot(
+            f"{app_environment or 'config'}_snapshot".lower(),
+            [cls.config_path(app_config_filename), cls.config_path(features_config_filename)],
+            build
+        )
+        config.update(files)
+        return config, default_server_config, server_configs
+
+    @classmethod
+    def apply(cls, snapshot):
+        """Swaps in config returned by `read_all`.
+
+        Nothing is awaited here, so event handlers see either the old config or the new one.
+        Handlers already holding a server config keep reading the old one until they finish.
+        """
+        cls.config, cls.default_server_config, cls.server_configs = snapshot
+        cls.server_config_cache.invalidate()
+
+    @classmethod
+    def load_all(cls):
+        cls.apply(cls.read_all())
+
+    @classmethod
+    async def reload(cls, check=None):
+        """Reloads every config file from disk without pausing event handling.
+
+        Args:
+            check: Function given the new config (see `read_all`) before it's applied, which can
+                raise AppError to keep the current config.
+
+        Returns:
+            list: Summary of each change (str), e.g. "changed features.servers.123.inactivity.days_threshold".
+
+        """
+        snapshot = await asyncio.get_event_loop().run_in_executor(None, cls.read_all)
+        if check:
+            check(snapshot)
+
+        old_config = cls.config
+        cls.apply(snapshot)
+
+        changes = []
+        for section in ("app", "features"):
+            changes.extend(config_changes(old_config.get(section), snapshot[0][section], section))
+
+        Logger.info(logger, f"Reloaded config with {len(changes)} changes.")
+        for change in changes:
+            Logger.info(logger, f"Config {change}")
+
+        return changes
+
+    @staticmethod
+    def resolve_server_configs(features):
+        """Resolves every server's configuration ahead of time (see `server_config`).
+
+        Returns:
+            tuple: (default server config, {server_id: server config}).
+
+        """
+        default_features = features.get("default") or {}
+        servers = features.get("servers") or {}
+        default_server_config = resolve_server_config(default_features, None)
+        server_configs = {
+            server_id: resolve_server_config(default_features, server_features)
+            for server_id, server_features in servers.items()
+        }
+        return default_server_config, server_configs
+
+    @classmethod
+    def server_config(cls, server_id=None):
+        """Returns a server's resolved, read-only configuration (the defaults for unconfigured servers).
+
+        Never queries the database: settings saved there only apply once the server's config
+        has been loaded with `load_server_config`.
+
+        e.g. Settings.server_config(server_id).inactivity.days_threshold
+        """
+        config = cls.server_config_cache.get(server_id)
+        if config is None:
+            config = cls.server_configs.get(server_id, cls.default_server_config)
+
+        return config
+
+    @classmethod
+    async def load_server_config(cls, server_id=None):
+        """Loads a server's config with the settings saved in the database, unless it's already cached.
+
+        Concurrent requests for the same server share one load. If the database can't be reached,
+        the config from the YAML files alone is returned (see `server_config`), and the database
+        isn't tried again for that server for a while.
+
+        Returns:
+            FrozenConfig: The server's resolved configuration.
+
+        """
+        cache = cls.server_config_cache
+        config = cache.get(server_id)
+        if config is not None:
+            return config
+        if cache.is_failing(server_id):
+            return cls.server_config(server_id)
+
+        async def load():
+            try:
+                return await cls._load_server_config(server_id)
+            except Exception as e:
+                # Logged once here rather than by every request waiting on the load
+                Logger.warn(
+                    logger, f"Couldn't load saved config for server {server_id}, using config files only. {e}"
+                )
+                raise
+
+        try:
+            return await cache.load(server_id, load)
+        except Exception:
+            return cls.server_config(server_id)
+
+    @classmethod
+    async def _load_default_features(cls):
+        """Returns the default features config with the default settings saved in the database."""
+        cache = cls.server_config_cache
+        if cache.default_features is not None:
+            return cache.default_features
+
+        async def load():
+            from main import database
+            generation = cache.generation
+            overrides = await asyncio.get_event_loop().run_in_executor(None, database.get_config_records, None)
+            default_features = apply_overrides(cls.config["features"].get("default"), overrides)
+            cache.put_default_features(default_features, generation)
+            return default_features
+
+        return await cache.load("default_features", load)
+
+    @classmethod
+    async def _load_server_config(cls, server_id):
+        from main import database
+        cache = cls.server_config_cache
+        generation = cache.generation
+        default_features = await cls._load_default_features()
+
+        if server_id is None:
+            config = resolve_server_config(default_features, None)
+        else:
+            overrides = await asyncio.get_event_loop().run_in_executor(None, database.get_config_records, server_id)
+            server_features = (cls.config["features"].get("servers") or {}).get(server_id)
+            config = resolve_server_config(default_features, apply_overrides(server_features, overrides))
+
+        cache.put(server_id, config, generation)
+        return config
+
+    @classmethod
+    async def set_config_value(cls, key, value, server_id=None):
+        """Saves a setting in the database, overriding the YAML config.
+
+        Args:
+            key(str): Dotted path of the setting in the features config (e.g. "inactivity.days_threshold").
+            value: New value of the setting.
+            server_id(int): Server the setting is for (None to change the default for every server).
+
+        Returns:
+            bool: True if the setting was saved, otherwise False.
+
+        """
+        from main import database
+        loop = asyncio.get_event_loop()
+        saved = await loop.run_in_executor(None, database.update_config_value, key, value, server_id)
+        if not saved:
+            saved = await loop.run_in_executor(None, database.add_config_record, key, value, server_id)
+
+        cls.server_config_cache.invalidate(server_id)
+        return saved
+
+    @classmethod
+    async def delete_config_value(cls, key, server_id=None):
+        """Removes a setting saved in the database, so the YAML config applies again."""
+        from main import database
+        await asyncio.get_event_loop().run_in_executor(None, database.delete_config_record, key, server_id)
+        cls.server_config_cache.invalidate(server_id)
 
     @classmethod
     def app_defaults(cls, key=""):
@@ -80,53 +609,17 @@ class Settings():
 
     @classmethod
     def on_message_features(cls, server_id, feature):
-        default_features = cls.default_features("on_message")
-        server_features = cls.server_features(server_id, "on_message")
-        if not server_features:
-            return None
-
-        server_settings = server_features.get(feature)
-        if not server_settings:
-            return None
-
-        # Combine default settings with server settings if not present already
-        if default_features:
-            default_settings = default_features.get(feature)
-            if default_settings:
-                for value in [v for v in default_settings if v not in server_settings]:
-                    server_settings[value] = default_settings[value]
-
-        return server_settings
+        return cls.server_config(server_id).on_message.get(feature)
 
     @classmethod
     def on_member_update_features(cls, server_id, feature):
-        default_features = cls.default_features("on_member_update")
-        server_features = cls.server_features(server_id, "on_member_update")
-        if not server_features:
-            return None
-
-        server_settings = server_features.get(feature)
-        if not server_settings:
-            return None
-
-        # Combine default settings with server settings if not present already
-        if default_features:
-            default_settings = default_features.get(feature)
-            if default_settings:
-                for value in [v for v in default_settings if v not in server_settings]:
-                    server_settings[value] = default_settings[value]
-
-        return server_settings
+        return cls.server_config(server_id).on_member_update.get(feature)
 
     @classmethod
     def command_settings(cls, command, server_id=None):
-        if server_id is not None:
-            cmd_settings = cls.server_features(server_id, "commands")
-            if cmd_settings:
-                return cmd_settings.get(command)
-
-        return cls.default_features("commands").get(command)
+        return cls.server_config(server_id).commands.get(command)
 
 
 # Read config files to set variables accordingly
 Settings.load_all()
+Settings.server_config_cache.max_size = Settings.app_defaults("server_config_cache_size") or 1000
@@ -1,51 +1,416 @@
 """General-purpose helper functions for the bot"""
+import asyncio
+import functools
+import logging
 import math
 import re
+import string
+import time
 import discord
+import discord.ext.commands
+from main.logger import Logger
 from main.settings import Settings
 
-def split_embeds(title: str, description: str, delimiter="\n", **kwargs):
-    """Returns a list of embeds split according to Discord character limits.
+logger = logging.getLogger(__name__)
+
+
+class ProgressReporter():
+    """Keeps a message updated with the progress of a long-running task.
+
+    Updates don't wait on the message being edited. They're coalesced in the background
+    so the message is edited at most once per interval, always with the latest content.
+
+    Attributes:
+        message (discord.Message): Message to show progress in (updates are ignored if None).
+        interval (float): Minimum seconds between edits (defaults to the 'progress_update_interval' setting).
+
+    """
+    def __init__(self, message: discord.Message, interval=None):
+        self.message = message
+        self.interval = interval if interval is not None else Settings.app_defaults("progress_update_interval")
+        self._pending = None
+        self._shown = message.content if message else None
+        self._last_edit = 0
+        self._task = None
+
+    def update(self, content: str):
+        """Sets the latest progress, to be shown once the interval allows."""
+        if not self.message or content == self._shown:
+            self._pending = None
+            return
+
+        self._pending = content
+        if not self._task or self._task.done():
+            self._task = asyncio.ensure_future(self._edit_when_due())
+
+    def cancel(self):
+        """Drops any progress that hasn't been shown yet."""
+        self._pending = None
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def finish(self, content: str = None):
+        """Shows the final progress right away (the latest update if content isn't given)."""
+        if content is not None:
+            self._pending = content
+        pending = self._pending
+        self.cancel()
+
+        if self.message and pending is not None and pending != self._shown:
+            await self._edit(pending)
+
+    async def _edit_when_due(self):
+        loop = asyncio.get_event_loop()
+        while self._pending is not None:
+            delay = self._last_edit + self.interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            content, self._pending = self._pending, None
+            if content is not None and content != self._shown:
+                await self._edit(content)
+
+    async def _edit(self, content: str):
+        self._last_edit = asyncio.get_event_loop().time()
+        try:
+            await self.message.edit(content=content)
+        except discord.HTTPException as e:
+            Logger.warn(logger, f"Couldn't update progress message: {e}")
+        else:
+            self._shown = content
+
+
+class TokenBucket():
+    """Paces requests to an API route so they stay within its rate limit.
+
+    Tokens refill continuously at `uses` per `per_seconds`, up to `uses` at once. If Discord
+    reports a rate limit anyway (see `rate_limit_reset_after`), the bucket can be paused until it resets.
+
+    Attributes:
+        uses (int): Number of requests allowed per window.
+        per_seconds (float): Length of the rate limit window in seconds.
+
+    """
+    _routes = {}
+
+    def __init__(self, uses: int, per_seconds: float):
+        self.uses = uses
+        self.per_seconds = per_seconds
+        self._tokens = uses
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def for_route(cls, route: str, uses: int, per_seconds: float):
+        """Returns the bucket shared by all requests to a route (creating it if needed).
+
+        A bucket created with other limits (e.g. before the config was reloaded) is updated to the
+        given ones, keeping any pause so requests already waiting on it stay paced together.
+        """
+        bucket = cls._routes.get(route)
+        if not bucket:
+            bucket = cls._routes[route] = cls(uses, per_seconds)
+        elif (bucket.uses, bucket.per_seconds) != (uses, per_seconds):
+            bucket.uses = uses
+            bucket.per_seconds = per_seconds
+            bucket._tokens = min(bucket._tokens, uses)
+        return bucket
+
+    async def acquire(self):
+        """Waits until a request can be made."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                rate = self.uses / self.per_seconds
+                self._tokens = min(self.uses, self._tokens + (now - self._updated) * rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / rate)
+
+    def pause(self, seconds: float):
+        """Stops handing out requests for a number of seconds (e.g. until a rate limit resets)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+def rate_limit_reset_after(error: discord.HTTPException):
+    """Returns the seconds until a rate limit resets, according to a failed request's headers (None if unknown)."""
+    headers = getattr(error.response, "headers", None) or {}
+    for header in ("X-RateLimit-Reset-After", "Retry-After"):
+        try:
+            return float(headers[header])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    return None
+
+def paginate_embeds(title: str, lines, reserve=0, delimiter="\n", **kwargs):
+    """Packs lines of text into as few embeds as Discord's limits allow.
+
+    Each embed is filled up to the total character limit, using its description first and
+    then as many fields as it can hold. Lines are kept whole unless a single line doesn't fit
+    in an empty description or field, in which case it's split at a space where possible.
+    Empty lines are left out, as Discord rejects empty embeds and fields.
 
     Args:
-        title(str): Title of the embed
-        description(str): Embed description (body text)
+        title(str): Title of each embed.
+        lines(iterable): Lines of text (str) for the embeds' body.
+        reserve(int): Characters to leave free in each embed (e.g. for a footer set afterwards).
+        delimiter(str): Text to join lines with.
+        **kwargs: Any other arguments accepted by discord.Embed().
+
+    Returns:
+        generator: discord.Embed objects, in order.
+
+    Raises:
+        ValueError: reserve leaves no room for the embeds' body.
+
     """
-    embeds = []
-    char_count = len(description)
-    max_chars = Settings.app_standards("embed")["description_limit"]
-    current_count = 0
-
-    # Minimum length of description as percentage of max_chars (0 to 1)
-    # e.g. 0.5 = description length must be at least 50% of max_chars
-    min_threshold = 0.25
-
-    while current_count < char_count:
-        current_description = description[current_count:]
-        if len(current_description) > max_chars:
-            end = current_count + max_chars
-            current_description = description[current_count:end]
-            split_description = current_description.rsplit(delimiter, maxsplit=1)
-            if len(split_description) < 2 or len(split_description[0]) < (max_chars * min_threshold):
-                split_description = current_description.rsplit(maxsplit=1)
-                if len(split_description) > 1:
-                    current_count += 1
-            elif len(split_description) > 1:
-                current_count += len(delimiter)
-
-            current_description = split_description[0]
-        
-        current_count += len(current_description)
-        embeds.append(discord.Embed(
-            title=title,
-            description=current_description,
-            **kwargs
-        ))
-
-    return embeds
+    limits = Settings.app_standards("embed")
+    title = title[:limits["title_limit"]]
+    total_limit = limits["total_character_limit"] - len(title) - max(reserve, 0)
+    if total_limit < 1:
+        raise ValueError(f"Can't reserve {reserve} characters in an embed titled '{title}'")
+    field_name = "\u200b"  # Field names can't be blank
+
+    blocks = []  # Description, then field values, as lists of lines
+    block_size = 0
+    total_size = 0
+
+    def block_limit():
+        return limits["description_limit"] if len(blocks) == 1 else limits["field_value_limit"]
+
+    def next_block():
+        """Starts a new field, or returns False if the embed can't hold another one."""
+        nonlocal block_size, total_size
+        extra = len(field_name) if blocks else 0
+        if blocks and (len(blocks) > limits["field_limit"] or total_size + extra >= total_limit):
+            return False
+        blocks.append([])
+        block_size = 0
+        total_size += extra
+        return True
+
+    def build():
+        nonlocal blocks, total_size
+        embed = discord.Embed(title=title, description=delimiter.join(blocks[0]), **kwargs)
+        for value in blocks[1:]:
+            if value:
+                embed.add_field(name=field_name, value=delimiter.join(value), inline=False)
+        blocks = []
+        total_size = 0
+        return embed
+
+    for line in lines:
+        position = 0
+        while position < len(line):
+            if not blocks:
+                next_block()
+
+            separator = len(delimiter) if blocks[-1] else 0
+            room = min(block_limit() - block_size, total_limit - total_size) - separator
+            remaining = len(line) - position
+            if remaining <= room:
+                piece = line[position:] if position else line
+                position = len(line)
+            elif not blocks[-1] and room > 0 and remaining > min(block_limit(), total_limit):
+                # Line is too long for this kind of block (or for any embed with this much reserved),
+                # so split it (at a space if one is close enough)
+                end = position + room
+                split_at = line.rfind(" ", position + room // 4, end)
+                if split_at > position:
+                    piece = line[position:split_at]
+                    position = split_at + 1
+                else:
+                    piece = line[position:end]
+                    position = end
+            else:
+                if not next_block():
+                    yield build()
+                continue
+
+            blocks[-1].append(piece)
+            block_size += separator + len(piece)
+            total_size += separator + len(piece)
+
+    if blocks and any(blocks):
+        yield build()
+
+def _lines(text: str):
+    """Yields each line of text without copying the rest of it."""
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
 
 def split_messages(content):
-    """Returns a list of messages split according to Discord character limits."""
+    """Splits text into messages according to Discord character limits.
+
+    Messages are split between lines where possible, otherwise between words. A code block
+    cut off by a split is closed at the end of the message and reopened in the next one.
+
+    Args:
+        content(str): Text to split, or an iterable of lines (read only as far as needed).
+
+    Returns:
+        generator: Each message's content (str), in order.
+
+    """
+    limit = Settings.app_standards("message")["content_limit"]
+    fence_mark = "```"
+    language = re.compile(r"\w{1,32}")
+    lines = _lines(content) if isinstance(content, str) else content
+
+    message = []
+    size = 0
+    fence = None  # Fence (with its language, if any) that opened the code block the text is currently in
+
+    def closing(in_fence):
+        return len(fence_mark) + 1 if in_fence else 0
+
+    for line in lines:
+        position = 0
+        while True:
+            # Longest piece that fits in a message of its own (with the code block reopened and closed)
+            width = limit - (len(fence) + 1 if fence else 0) - closing(True)
+            piece = line[position:position + width] if position or len(line) > width else line
+            if len(line) - position > width:
+                split_at = line.rfind(" ", position + width // 4, position + width)
+                if split_at > position:
+                    piece = line[position:split_at]
+
+            in_fence = fence is not None
+            if piece.count(fence_mark) % 2:
+                in_fence = not in_fence
+
+            separator = 1 if message else 0
+            if message and size + separator + len(piece) + closing(in_fence) > limit:
+                yield "\n".join(message) + (f"\n{fence_mark}" if fence else "")
+                message = [fence] if fence else []
+                size = len(fence) if fence else 0
+                separator = 1 if message else 0
+
+            message.append(piece)
+            size += separator + len(piece)
+            if in_fence and not fence:
+                # A language only counts if it's all that follows the fence on its line
+                fence = fence_mark
+                after = piece[piece.rfind(fence_mark) + len(fence_mark):]
+                if position + len(piece) >= len(line) and language.fullmatch(after.rstrip()):
+                    fence += after.rstrip()
+            elif not in_fence:
+                fence = None
+
+            position += len(piece)
+            if position >= len(line):
+                break
+            if line[position] == " ":
+                position += 1
+
+    if message and any(message):
+        yield "\n".join(message)
+
+class ChannelNameIndex():
+    """Looks up a server's channels by name.
+
+    Each server's index is built on first use and must be invalidated whenever one of its
+    channels is created, renamed or deleted.
+    """
+    def __init__(self):
+        self._channels = {}  # {guild_id: {name: channel}}
+
+    def get(self, server: discord.Guild, name: str):
+        """Returns the server's channel with the given name (None if there isn't one)."""
+        channels = self._channels.get(server.id)
+        if channels is None:
+            channels = {}
+            for channel in server.channels:
+                # Keep the first match, like discord.utils.get
+                channels.setdefault(channel.name, channel)
+            self._channels[server.id] = channels
+
+        return channels.get(name)
+
+    def invalidate(self, server_id: int):
+        """Drops a server's index so it's rebuilt on next use."""
+        self._channels.pop(server_id, None)
+
+
+channel_names = ChannelNameIndex()
+
+
+class CompiledTemplate():
+    """Text with placeholders (see `substitute_text`), parsed once so it can be rendered cheaply.
+
+    Attributes:
+        parts (list): (literal text, field name, conversion, format spec) tuples, as parsed by string.Formatter.
+        channel_references (list): Names of channels referenced as [#name] (None if a reference
+            depends on a placeholder, so references have to be found after rendering).
+
+    """
+    CHANNEL_REFERENCE = re.compile(r"\[#(.+?)\]")
+    _formatter = string.Formatter()
+
+    def __init__(self, text: str):
+        self.parts = [
+            (literal, field_name, conversion, format_spec)
+            for literal, field_name, format_spec, conversion in self._formatter.parse(text)
+        ]
+
+        # Placeholders are marked so references relying on them can be told apart
+        skeleton = "".join(literal + ("\0" if field_name is not None else "") for literal, field_name, _, _ in self.parts)
+        references = set(self.CHANNEL_REFERENCE.findall(skeleton))
+        self.channel_references = None if any("\0" in r for r in references) else list(references)
+
+    def render(self, substitutions: dict, server: discord.Guild=None) -> str:
+        """Returns the text with placeholders and channel references replaced.
+
+        Args:
+            substitutions(dict): Value of each placeholder.
+            server(discord.Guild): Server to find referenced channels in (references are kept as-is if None).
+
+        """
+        pieces = []
+        for literal, field_name, conversion, format_spec in self.parts:
+            pieces.append(literal)
+            if field_name is not None:
+                value, _ = self._formatter.get_field(field_name, (), substitutions)
+                value = self._formatter.convert_field(value, conversion)
+                if format_spec and "{" in format_spec:
+                    format_spec = self._formatter.vformat(format_spec, (), substitutions)
+                pieces.append(format(value, format_spec or ""))
+        text = "".join(pieces)
+
+        if server is None:
+            return text
+
+        references = self.channel_references
+        if references is None:
+            references = set(self.CHANNEL_REFERENCE.findall(text))
+        for reference in references:
+            channel = channel_names.get(server, reference)
+            if channel:
+                text = text.replace(f"[#{reference}]", channel.mention)
+
+        return text
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text: str) -> CompiledTemplate:
+    """Returns the parsed form of a template, reusing it for text that has been seen before."""
+    return CompiledTemplate(text)
 
 def substitute_text(text: str, context: discord.ext.commands.Context):
     """Replaces placeholders in text with their intended values."""
@@ -72,31 +437,31 @@ def substitute_text(text: str, context: discord.ext.commands.Context):
         "owner_name": owner_name,
         "owner_discriminator": owner_discriminator
     }
-    text = text.format(**substitutions)
-    try:
-        re_channels = set(re.findall(r"\[#(.+?)\]", text))
-        for re_channel in re_channels:
-            channel_object = discord.utils.get(context.guild.channels, name=re_channel)
-            if channel_object:
-                text = text.replace(f"[#{re_channel}]", channel_object.mention)
-    except AttributeError:
-        pass
-
-    return text
+    return compile_template(text).render(substitutions, getattr(context, "guild", None))
 
 async def say(channel: discord.abc.Messageable, context: discord.ext.commands.Context=None, parse=False, **kwargs):
     """
+    Content over Discord's character limit is sent as several messages (see `split_messages`),
+    with any other arguments (e.g. embed) attached to the last one.
+
     Args:
         channel(discord.abc.Messageable): The message's destination (e.g. TextChannel, DMChannel, etc.)
         context(discord.ext.commands.Context): The original context of the message
-        **kwargs: Any arguments accepted by discord.Channel.send()
+        **kwargs: Any arguments accepted by discord.Channel.send(). content can also be an iterable of lines.
+
+    Returns:
+        discord.Message: The last message sent.
+
     """
+    content = kwargs.get("content")
     if parse and context:
-        content = kwargs.get("content")
         embed = kwargs.get("embed")
 
-        if content:
-            kwargs["content"] = substitute_text(content, context)
+        if isinstance(content, str):
+            content = substitute_text(content, context)
+        elif content:
+            content = (substitute_text(line, context) for line in content)
+
         if embed:
             if embed.title:
                 embed.title = substitute_text(embed.title, context)
@@ -109,4 +474,17 @@ async def say(channel: discord.abc.Messageable, context: discord.ext.commands.Co
                     field.value = substitute_text(field.value, context)
             kwargs["embed"] = embed
 
+    if content is None or (isinstance(content, str) and len(content) <= Settings.app_standards("message")["content_limit"]):
+        if content is not None:
+            kwargs["content"] = content
+        return await channel.send(**kwargs)
+
+    # Send each message once the next one is ready, so the last one can carry the other arguments
+    previous = None
+    for message in split_messages(content):
+        if previous is not None:
+            await channel.send(content=previous)
+        previous = message
+
+    kwargs["content"] = previous
     return await channel.send(**kwargs)
@@ -1,4 +1,19 @@
 # -*- coding: utf-8 -*-
+import importlib
+import time
+imports_started_at = time.perf_counter()
+import_times = []
+
+def timed_import(name):
+    """Imports a module, noting how long it took (excluding anything an earlier import already loaded)."""
+    started_at = time.perf_counter()
+    importlib.import_module(name)
+    import_times.append((name, time.perf_counter() - started_at))
+
+# Third-party packages first, so the bot's own modules are timed without them
+for module_name in ("yaml", "discord", "psycopg2", "main.settings", "main.database", "main.bot"):
+    timed_import(module_name)
+
 import errno
 import logging
 import logging.config
@@ -6,8 +21,9 @@ import os
 import yaml
 import discord
 from pathlib import Path
-from main.settings import Settings
+from main.settings import Settings, load_snapshot
 from main.bot import Bot
+from main.logger import Logger, QueueLogging
 
 try:
     os.makedirs("logs")
@@ -15,9 +31,22 @@ except OSError as e:
     if e.errno != errno.EEXIST:
         raise
 
-with open(Path(__file__).parent.joinpath("logging.yaml"), "r") as f:
-    log_config = yaml.safe_load(f.read())
+def load_log_config(path):
+    with open(path, "r") as f:
+        return yaml.safe_load(f.read())
+
+log_config_path = Path(__file__).parent.joinpath("logging.yaml")
+log_config = load_snapshot("logging", [log_config_path], lambda: load_log_config(log_config_path))
+queue_config = log_config.pop("queue", None)
+sample_rates = log_config.pop("sampling", None) or {}
 logging.config.dictConfig(log_config)
+QueueLogging.start(queue_config)
+for logger_name, rate in sample_rates.items():
+    Logger.set_sample_rate(logging.getLogger(logger_name), rate)
+import_breakdown = ", ".join(
+    f"{name} {seconds:.2f}s" for name, seconds in sorted(import_times, key=lambda t: t[1], reverse=True) if seconds >= 0.005
+)
+logging.getLogger("start").info(f"Imported in {time.perf_counter() - imports_started_at:.2f}s ({import_breakdown})")
 
 def main():
     command_prefix = Settings.app_defaults("cmd_prefix")
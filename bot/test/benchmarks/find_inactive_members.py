@@ -0,0 +1,89 @@
+"""Benchmarks finding inactive members from a scan, against the list-based logic it replaced.
+
+Run from the bot directory:
+    python -m test.benchmarks.find_inactive_members [members] [active authors] [messages]
+"""
+import datetime
+import random
+import sys
+import time
+
+import discord
+
+from main.commands.admin.admin_utils import ActivityScan, find_inactive_members
+
+
+class Member(discord.mixins.Hashable):
+    """Stand-in for discord.Member, with the same equality and hashing."""
+    __slots__ = ("id", "bot", "joined_at")
+
+    def __init__(self, member_id, joined_at, bot=False):
+        self.id = member_id
+        self.joined_at = joined_at
+        self.bot = bot
+
+
+def make_server(member_count, author_count, message_count, seed=1):
+    """Returns (members, [(author, reaction users)] per message, time boundary)."""
+    rng = random.Random(seed)
+    time_boundary = datetime.datetime.utcnow() - datetime.timedelta(days=14)
+    members = [
+        Member(i, time_boundary - datetime.timedelta(days=rng.randint(-30, 365)), bot=(i % 100 == 0))
+        for i in range(1, member_count + 1)
+    ]
+    authors = rng.sample(members, author_count)
+    messages = [
+        (rng.choice(authors), [rng.choice(authors) for _ in range(rng.randint(0, 3))])
+        for _ in range(message_count)
+    ]
+    return members, messages, time_boundary
+
+
+def list_based(members, messages, time_boundary):
+    """The original scan: active members kept in a list and searched for each author and reaction."""
+    active_members = []
+    for author, reactors in messages:
+        if author not in active_members:
+            active_members.append(author)
+        for user in reactors:
+            if user not in active_members:
+                active_members.append(user)
+
+    return [
+        user for user in members
+        if user not in active_members and user.joined_at < time_boundary and not user.bot
+    ]
+
+
+def set_based(members, messages, time_boundary):
+    """The current scan: activity kept by member ID, then one set difference."""
+    scan = ActivityScan(candidates=[m.id for m in members if not m.bot and m.joined_at < time_boundary])
+    now = datetime.datetime.utcnow()
+    for author, reactors in messages:
+        scan.mark_active(author.id, now)
+        for user in reactors:
+            scan.mark_active(user.id, now)
+
+    return find_inactive_members(members, scan.active_member_ids, time_boundary)
+
+
+def timed(function, *args):
+    started_at = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started_at
+
+
+def main(member_count=20000, author_count=5000, message_count=5000):
+    members, messages, time_boundary = make_server(member_count, author_count, message_count)
+    print(f"{member_count} members, {author_count} active authors, {message_count} messages")
+
+    new_result, new_time = timed(set_based, members, messages, time_boundary)
+    old_result, old_time = timed(list_based, members, messages, time_boundary)
+    assert [m.id for m in new_result] == [m.id for m in old_result], "Results differ"
+
+    print(f"  list: {old_time:.3f}s")
+    print(f"  set:  {new_time:.3f}s ({old_time / new_time:.0f}x faster, {len(new_result)} inactive)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
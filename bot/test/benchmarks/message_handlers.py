@@ -0,0 +1,128 @@
+"""Benchmarks handling server messages, against the on_message logic the handler chain replaced.
+
+The mix is mostly ordinary chat with some MEE6 level-up announcements; no message is in a
+picture-only channel, so both paths only do their checks and the role edits (which are counted, not sent).
+
+Run from the bot directory:
+    python -m test.benchmarks.message_handlers [messages] [level-ups per 100 messages]
+"""
+import asyncio
+import random
+import re
+import sys
+import time
+
+import discord
+
+from main.message_features import message_handlers
+from main.settings import freeze
+
+MEE6_ID = 159985870458322944
+LEVEL_PATTERN = r"<@(?:.+)>.+level ([0-9]+)"
+
+
+class Stub():
+    """Bare object with the given attributes."""
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Member(Stub):
+    edits = 0
+
+    async def add_roles(self, *roles, reason=None, atomic=True):
+        Member.edits += 1
+        self.roles.extend(roles)
+
+
+def make_server(message_count, level_up_rate, seed=1):
+    """Returns (server config, messages)."""
+    rng = random.Random(seed)
+    role_levels = {5: 1005, 10: 1010, 20: 1020, 30: 1030, 40: 1040}
+    roles = [Stub(id=role_id) for role_id in role_levels.values()]
+    server = Stub(id=1, name="Server", roles=roles)
+    server.get_role = {r.id: r for r in roles}.get
+    members = {i: Member(id=i, name=f"Member {i}", roles=[], guild=server) for i in range(1, 501)}
+    server.get_member = members.get
+
+    config = freeze({"on_message": {
+        "mee6_level_up": {
+            "enabled": True,
+            "bot_id": MEE6_ID,
+            "message_pattern": LEVEL_PATTERN,
+            "roles": {level: {"id": role_id} for level, role_id in role_levels.items()},
+        },
+        "pics_only": {
+            "enabled": True,
+            "channels": {2: {"message": "Pictures only!"}},
+        },
+    }})
+
+    mee6 = Stub(id=MEE6_ID, name="MEE6")
+    channel = Stub(id=3, name="general")
+    messages = []
+    for _ in range(message_count):
+        if rng.randrange(100) < level_up_rate:
+            member = members[rng.randint(1, 500)]
+            content = f"GG <@{member.id}>, you just advanced to level {rng.randint(1, 50)}!"
+            messages.append(Stub(author=mee6, guild=server, channel=channel, attachments=[], mentions=[member], content=content))
+        else:
+            author = members[rng.randint(1, 500)]
+            messages.append(Stub(author=author, guild=server, channel=channel, attachments=[], mentions=[], content="Hello"))
+
+    return config, messages
+
+
+async def inline(server_config, message):
+    """The original on_message checks: settings looked up and the pattern compiled for every message."""
+    mee6_level_up = server_config.on_message.get("mee6_level_up")
+    if mee6_level_up and mee6_level_up.get("enabled") and message.author.id == mee6_level_up["bot_id"]:
+        result = re.compile(r"{}".format(mee6_level_up["message_pattern"])).search(message.content)
+        if result:
+            mentioned = message.mentions[0]
+            level = int(result.group(1))
+            roles = mee6_level_up["roles"]
+            for r in roles:
+                if level >= r:
+                    role = discord.utils.get(message.guild.roles, id=roles[r]["id"])
+                    await mentioned.add_roles(role, reason=f"User reached level {r}")
+
+    pics_only = server_config.on_message.get("pics_only")
+    if pics_only and pics_only.get("enabled"):
+        if message.channel.id in pics_only["channels"] and not message.attachments:
+            return True
+
+    return False
+
+
+async def chained(server_config, message):
+    """The current handling: the server's cached handler chain."""
+    return await message_handlers.get(message.guild.id, server_config).handle(message)
+
+
+async def timed(handle, config, messages):
+    for message in messages:
+        for member in message.mentions:
+            member.roles.clear()
+    Member.edits = 0
+
+    started_at = time.perf_counter()
+    for message in messages:
+        await handle(config, message)
+    return time.perf_counter() - started_at, Member.edits
+
+
+def main(message_count=200000, level_up_rate=5):
+    config, messages = make_server(message_count, level_up_rate)
+    print(f"{message_count} messages, {level_up_rate}% level-ups")
+
+    loop = asyncio.get_event_loop()
+    old_time, old_edits = loop.run_until_complete(timed(inline, config, messages))
+    new_time, new_edits = loop.run_until_complete(timed(chained, config, messages))
+
+    print(f"  inline: {old_time:.3f}s, {old_edits} role edits")
+    print(f"  chain:  {new_time:.3f}s, {new_edits} role edits ({old_time / new_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,67 @@
+import datetime
+import unittest
+
+from main.commands.admin import admin_utils
+from test.helpers import MockMember
+
+
+class FindInactiveMembersTests(unittest.TestCase):
+    """Tests for `admin_utils.find_inactive_members`."""
+
+    def setUp(self):
+        self.time_boundary = datetime.datetime(2020, 6, 1)
+        self.before = self.time_boundary - datetime.timedelta(days=30)
+
+    def member(self, member_id, joined_at=None, bot=False):
+        return MockMember(id=member_id, joined_at=joined_at or self.before, bot=bot)
+
+    def test_members_not_active_are_inactive(self):
+        members = [self.member(i) for i in range(1, 6)]
+        inactive = admin_utils.find_inactive_members(members, {2, 4}, self.time_boundary)
+        self.assertEqual([m.id for m in inactive], [1, 3, 5])
+
+    def test_keeps_server_member_order(self):
+        members = [self.member(i) for i in (9, 3, 7, 1)]
+        inactive = admin_utils.find_inactive_members(members, set(), self.time_boundary)
+        self.assertEqual([m.id for m in inactive], [9, 3, 7, 1])
+
+    def test_bots_are_left_out(self):
+        members = [self.member(1), self.member(2, bot=True)]
+        inactive = admin_utils.find_inactive_members(members, set(), self.time_boundary)
+        self.assertEqual([m.id for m in inactive], [1])
+
+    def test_members_who_joined_after_boundary_are_left_out(self):
+        members = [
+            self.member(1),
+            self.member(2, joined_at=self.time_boundary),
+            self.member(3, joined_at=self.time_boundary + datetime.timedelta(days=1)),
+        ]
+        inactive = admin_utils.find_inactive_members(members, set(), self.time_boundary)
+        self.assertEqual([m.id for m in inactive], [1])
+
+    def test_accepts_dict_keys_view(self):
+        members = [self.member(i) for i in range(1, 4)]
+        last_seen = {1: self.time_boundary, 3: self.time_boundary}
+        inactive = admin_utils.find_inactive_members(members, last_seen.keys(), self.time_boundary)
+        self.assertEqual([m.id for m in inactive], [2])
+
+    def test_active_ids_of_non_members_are_ignored(self):
+        members = [self.member(1), self.member(2)]
+        inactive = admin_utils.find_inactive_members(members, {2, 100, 200}, self.time_boundary)
+        self.assertEqual([m.id for m in inactive], [1])
+
+    def test_no_members(self):
+        self.assertEqual(admin_utils.find_inactive_members([], {1}, self.time_boundary), [])
+
+
+class ActivityScanTests(unittest.TestCase):
+    """Tests for `admin_utils.ActivityScan` activity tracking."""
+
+    def test_mark_active_keeps_latest_time(self):
+        scan = admin_utils.ActivityScan(candidates=[1, 2])
+        later = datetime.datetime(2020, 6, 2)
+        scan.mark_active(1, later)
+        scan.mark_active(1, datetime.datetime(2020, 6, 1))
+        self.assertEqual(scan.last_seen, {1: later})
+        self.assertEqual(scan.remaining_candidates, {2})
+        self.assertEqual(set(scan.active_member_ids), {1})
@@ -0,0 +1,195 @@
+import unittest
+import unittest.mock
+
+from main import message_features
+from main.settings import freeze
+from test.helpers import AsyncMock, MockGuild, MockMember, MockMessage, MockRole, async_test
+
+MEE6_ID = 159985870458322944
+
+
+def level_up_settings(**kwargs):
+    settings = {
+        "enabled": True,
+        "bot_id": MEE6_ID,
+        "message_pattern": r"<@(?:.+)>.+level ([0-9]+)",
+        # Deliberately out of order, as config keys can be
+        "roles": {20: {"id": 200}, 5: {"id": 50}, 10: {"id": 100}, 40: {"id": 400}},
+    }
+    settings.update(kwargs)
+    return settings
+
+
+class Mee6LevelUpTests(unittest.TestCase):
+    """Tests for `message_features.Mee6LevelUp`."""
+
+    def setUp(self):
+        self.feature = message_features.Mee6LevelUp(level_up_settings())
+        self.roles = {role_id: MockRole(id=role_id) for role_id in (50, 100, 200, 400)}
+        self.guild = MockGuild()
+        self.guild.get_role.side_effect = self.roles.get
+
+    def member(self, *role_ids):
+        member = MockMember(roles=[self.roles[role_id] for role_id in role_ids])
+        member.guild = self.guild
+        return member
+
+    def missing_ids(self, member, level):
+        return [role.id for role in self.feature.missing_roles(member, level)]
+
+    def test_levels_sorted(self):
+        self.assertEqual(self.feature.levels, [5, 10, 20, 40])
+        self.assertEqual(self.feature.role_ids, [50, 100, 200, 400])
+
+    def test_below_first_threshold(self):
+        self.assertEqual(self.missing_ids(self.member(), 4), [])
+        self.assertEqual(self.missing_ids(self.member(), 0), [])
+
+    def test_exactly_at_threshold(self):
+        self.assertEqual(self.missing_ids(self.member(), 5), [50])
+        self.assertEqual(self.missing_ids(self.member(), 10), [50, 100])
+
+    def test_between_thresholds(self):
+        self.assertEqual(self.missing_ids(self.member(), 19), [50, 100])
+
+    def test_above_every_threshold(self):
+        self.assertEqual(self.missing_ids(self.member(), 99), [50, 100, 200, 400])
+
+    def test_roles_already_held_are_skipped(self):
+        self.assertEqual(self.missing_ids(self.member(50, 200), 25), [100])
+        self.assertEqual(self.missing_ids(self.member(50, 100, 200), 25), [])
+
+    def test_roles_missing_from_server_are_skipped(self):
+        del self.roles[100]
+        self.assertEqual(self.missing_ids(self.member(), 25), [50, 200])
+
+    def test_no_roles_configured(self):
+        feature = message_features.Mee6LevelUp(level_up_settings(roles=None))
+        self.assertEqual(feature.missing_roles(self.member(), 50), [])
+
+    @async_test
+    async def test_reconcile_adds_missing_roles_in_one_edit(self):
+        member = self.member(50)
+        added = await self.feature.reconcile(member, 20)
+
+        self.assertEqual([role.id for role in added], [100, 200])
+        member.add_roles.assert_called_once_with(
+            self.roles[100], self.roles[200], reason="User reached level 20", atomic=False
+        )
+
+    @async_test
+    async def test_reconcile_with_nothing_missing(self):
+        member = self.member(50, 100)
+        self.assertEqual(await self.feature.reconcile(member, 10), [])
+        member.add_roles.assert_not_called()
+
+    @async_test
+    async def test_handle_levels_up_mentioned_member(self):
+        member = self.member()
+        self.guild.get_member.side_effect = lambda member_id: member if member_id == 123 else None
+        message = MockMessage(
+            author=MockMember(id=MEE6_ID), guild=self.guild, mentions=[], content="GG <@!123>, you reached level 12!"
+        )
+
+        self.assertTrue(self.feature.applies(message))
+        self.assertFalse(await self.feature.handle(message))
+        member.add_roles.assert_called_once_with(
+            self.roles[50], self.roles[100], reason="User reached level 12", atomic=False
+        )
+
+    def test_only_applies_to_mee6(self):
+        message = MockMessage(author=MockMember(id=1), content="GG <@123>, you reached level 12!")
+        self.assertFalse(self.feature.applies(message))
+
+
+class RecordingFeature():
+    """Feature that records the order it's asked to handle messages in."""
+    calls = []
+
+    def __init__(self, settings):
+        self.name = settings["name"]
+        self.consume = settings.get("consume", False)
+        self.apply = settings.get("apply", True)
+
+    def applies(self, message):
+        return self.apply
+
+    async def handle(self, message):
+        RecordingFeature.calls.append(self.name)
+        return self.consume
+
+
+class MessageHandlerChainTests(unittest.TestCase):
+    """Tests for `message_features.MessageHandlerChain` and `MessageHandlerCache`."""
+
+    def setUp(self):
+        RecordingFeature.calls = []
+        features = (("first", RecordingFeature), ("second", RecordingFeature), ("third", RecordingFeature))
+        patcher = unittest.mock.patch.object(message_features, "FEATURES", features)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def chain(self, **settings):
+        on_message = {
+            name: {"enabled": True, "name": name, **feature_settings}
+            for name, feature_settings in settings.items()
+        }
+        return message_features.MessageHandlerChain(on_message)
+
+    @async_test
+    async def test_features_handle_in_feature_order(self):
+        # Config order doesn't matter, only the order of FEATURES
+        chain = self.chain(third={}, first={}, second={})
+        self.assertFalse(await chain.handle(MockMessage()))
+        self.assertEqual(RecordingFeature.calls, ["first", "second", "third"])
+
+    @async_test
+    async def test_disabled_features_left_out(self):
+        chain = self.chain(first={"enabled": False}, second={}, third={})
+        self.assertEqual(len(chain.handlers), 2)
+        await chain.handle(MockMessage())
+        self.assertEqual(RecordingFeature.calls, ["second", "third"])
+
+    @async_test
+    async def test_consuming_feature_stops_chain(self):
+        chain = self.chain(first={}, second={"consume": True}, third={})
+        self.assertTrue(await chain.handle(MockMessage()))
+        self.assertEqual(RecordingFeature.calls, ["first", "second"])
+
+    @async_test
+    async def test_features_that_dont_apply_are_skipped(self):
+        chain = self.chain(first={"apply": False}, second={}, third={"apply": False})
+        await chain.handle(MockMessage())
+        self.assertEqual(RecordingFeature.calls, ["second"])
+
+    def test_no_features_enabled(self):
+        self.assertEqual(message_features.MessageHandlerChain({}).handlers, ())
+
+    def test_cache_rebuilds_when_config_changes(self):
+        cache = message_features.MessageHandlerCache()
+        config = freeze({"on_message": {"first": {"enabled": True, "name": "first"}}})
+        chain = cache.get(1, config)
+
+        self.assertIs(cache.get(1, config), chain)
+        new_config = freeze({"on_message": {"second": {"enabled": True, "name": "second"}}})
+        new_chain = cache.get(1, new_config)
+        self.assertIsNot(new_chain, chain)
+        self.assertEqual([h.name for h in new_chain.handlers], ["second"])
+
+    def test_cache_bounded(self):
+        cache = message_features.MessageHandlerCache(max_size=2)
+        configs = {server_id: freeze({"on_message": {}}) for server_id in (1, 2, 3)}
+        first = cache.get(1, configs[1])
+        cache.get(2, configs[2])
+        # Using server 1 again makes server 2 the least recently used
+        self.assertIs(cache.get(1, configs[1]), first)
+        cache.get(3, configs[3])
+
+        self.assertEqual(list(cache._chains), [1, 3])
+
+    def test_cache_invalidate(self):
+        cache = message_features.MessageHandlerCache()
+        config = freeze({"on_message": {}})
+        chain = cache.get(1, config)
+        cache.invalidate(1)
+        self.assertIsNot(cache.get(1, config), chain)
@@ -0,0 +1,256 @@
+import random
+import unittest
+
+from main import utils
+from main.settings import Settings
+
+EMBED_LIMITS = Settings.app_standards("embed")
+CONTENT_LIMIT = Settings.app_standards("message")["content_limit"]
+
+
+def embed_blocks(embed):
+    """Returns an embed's description followed by its field values."""
+    return [embed.description or ""] + [field.value for field in embed.fields]
+
+
+def sample_lines(count, seed=1):
+    rng = random.Random(seed)
+    return [
+        " ".join("x" * rng.randint(1, 12) for _ in range(rng.randint(1, 15))) + f" #{i}"
+        for i in range(count)
+    ]
+
+
+class PaginateEmbedsTests(unittest.TestCase):
+    """Tests for `utils.paginate_embeds`."""
+
+    def paginate(self, lines, **kwargs):
+        return list(utils.paginate_embeds(title="Title", lines=lines, **kwargs))
+
+    def assertWithinLimits(self, embed, reserve=0):
+        self.assertLessEqual(len(embed), EMBED_LIMITS["total_character_limit"] - reserve)
+        self.assertLessEqual(len(embed.title), EMBED_LIMITS["title_limit"])
+        self.assertLessEqual(len(embed.description), EMBED_LIMITS["description_limit"])
+        self.assertLessEqual(len(embed.fields), EMBED_LIMITS["field_limit"])
+        for field in embed.fields:
+            self.assertLessEqual(len(field.name), EMBED_LIMITS["field_name_limit"])
+            self.assertLessEqual(len(field.value), EMBED_LIMITS["field_value_limit"])
+            self.assertTrue(field.value)
+
+    def test_every_embed_within_limits(self):
+        embeds = self.paginate(sample_lines(3000))
+        self.assertGreater(len(embeds), 1)
+        for embed in embeds:
+            self.assertWithinLimits(embed)
+
+    def test_embeds_are_filled(self):
+        lines = sample_lines(3000)
+        embeds = self.paginate(lines)
+        text_size = sum(len(line) + 1 for line in lines)
+        # Each embed but the last should be close to the total limit
+        for embed in embeds[:-1]:
+            self.assertGreater(len(embed), EMBED_LIMITS["total_character_limit"] * 0.9)
+        self.assertLess(len(embeds), text_size / (EMBED_LIMITS["total_character_limit"] * 0.9) + 1)
+
+    def test_field_count_limit(self):
+        # Lines just under the field value limit fill one field each
+        lines = ["y" * (EMBED_LIMITS["field_value_limit"] - 10)] * 60
+        for embed in self.paginate(lines):
+            self.assertWithinLimits(embed)
+
+        short_lines = ["z"] * 20000
+        for embed in self.paginate(short_lines):
+            self.assertWithinLimits(embed)
+
+    def test_long_lines_are_split(self):
+        line = " ".join(["word"] * 2000)
+        embeds = self.paginate([line])
+        for embed in embeds:
+            self.assertWithinLimits(embed)
+
+        words = " ".join(piece for embed in embeds for piece in embed_blocks(embed)).split()
+        self.assertEqual(words, ["word"] * 2000)
+
+    def test_long_line_without_spaces(self):
+        line = "a" * 10000
+        embeds = self.paginate([line])
+        for embed in embeds:
+            self.assertWithinLimits(embed)
+        self.assertEqual("".join(piece for embed in embeds for piece in embed_blocks(embed)), line)
+
+    def test_title_limit(self):
+        embeds = list(utils.paginate_embeds(title="t" * 1000, lines=sample_lines(500)))
+        for embed in embeds:
+            self.assertEqual(len(embed.title), EMBED_LIMITS["title_limit"])
+            self.assertWithinLimits(embed)
+
+    def test_reserve_leaves_room_for_footer(self):
+        footer = "f" * EMBED_LIMITS["footer_limit"]
+        embeds = self.paginate(sample_lines(3000), reserve=len(footer))
+        for embed in embeds:
+            self.assertWithinLimits(embed, reserve=len(footer))
+            embed.set_footer(text=footer)
+            self.assertLessEqual(len(embed), EMBED_LIMITS["total_character_limit"])
+
+    def test_line_order_kept_across_pages(self):
+        lines = sample_lines(3000)
+        embeds = self.paginate(lines)
+        rejoined = [line for embed in embeds for block in embed_blocks(embed) for line in block.split("\n")]
+        self.assertEqual(rejoined, lines)
+
+    def test_accepts_generator(self):
+        lines = sample_lines(100)
+        embeds = self.paginate(line for line in lines)
+        self.assertEqual(embeds[0].description.split("\n")[:100], lines[:len(embeds[0].description.split("\n"))])
+
+    def test_no_lines(self):
+        self.assertEqual(self.paginate([]), [])
+
+    def test_empty_lines_left_out(self):
+        self.assertEqual(self.paginate([""]), [])
+        self.assertEqual(self.paginate(["", "", ""]), [])
+        embeds = self.paginate(["a", "", "b"])
+        self.assertEqual(len(embeds), 1)
+        self.assertEqual(embeds[0].description, "a\nb")
+
+    def test_reserve_leaving_no_room(self):
+        for reserve in (EMBED_LIMITS["total_character_limit"], EMBED_LIMITS["total_character_limit"] + 100):
+            with self.assertRaises(ValueError):
+                self.paginate(["line"], reserve=reserve)
+
+    def test_large_reserve(self):
+        reserve = EMBED_LIMITS["total_character_limit"] - len("Title") - 20
+        lines = sample_lines(50)
+        embeds = self.paginate(lines, reserve=reserve)
+        for embed in embeds:
+            self.assertWithinLimits(embed, reserve=reserve)
+        # Words may be split too, but nothing is lost or reordered
+        rejoined = "".join(piece for embed in embeds for piece in embed_blocks(embed))
+        self.assertEqual(rejoined.replace("\n", "").replace(" ", ""), "".join(lines).replace(" ", ""))
+
+
+class SplitMessagesTests(unittest.TestCase):
+    """Tests for `utils.split_messages`."""
+
+    def test_short_content_is_one_message(self):
+        self.assertEqual(list(utils.split_messages("hello\nthere")), ["hello\nthere"])
+
+    def test_messages_within_limit(self):
+        content = "\n".join(sample_lines(2000))
+        messages = list(utils.split_messages(content))
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(len(message), CONTENT_LIMIT)
+
+    def test_lossless_rejoin(self):
+        content = "\n".join(sample_lines(2000))
+        self.assertEqual("\n".join(utils.split_messages(content)), content)
+
+    def test_splits_between_lines(self):
+        lines = sample_lines(2000)
+        for message in utils.split_messages("\n".join(lines)):
+            for line in message.split("\n"):
+                self.assertIn(line, lines)
+
+    def test_long_line_split_between_words(self):
+        words = [f"w{i}" for i in range(2000)]
+        messages = list(utils.split_messages(" ".join(words)))
+        self.assertGreater(len(messages), 1)
+        for message in messages:
+            self.assertLessEqual(len(message), CONTENT_LIMIT)
+        self.assertEqual(" ".join(messages).split(), words)
+
+    def test_long_line_without_spaces(self):
+        content = "a" * (CONTENT_LIMIT * 3 + 5)
+        messages = list(utils.split_messages(content))
+        for message in messages:
+            self.assertLessEqual(len(message), CONTENT_LIMIT)
+        self.assertEqual("".join(messages), content)
+
+    def test_code_block_reopened(self):
+        code = [f"line {i} = {'v' * 40}" for i in range(200)]
+        content = "Before\n```py\n" + "\n".join(code) + "\n```\nAfter"
+        messages = list(utils.split_messages(content))
+        self.assertGreater(len(messages), 1)
+
+        for i, message in enumerate(messages):
+            self.assertLessEqual(len(message), CONTENT_LIMIT)
+            # Every message has balanced fences, so each renders on its own
+            self.assertEqual(message.count("```") % 2, 0, message[-50:])
+            if i:
+                self.assertTrue(message.startswith("```py"))
+
+        # Dropping the added fences gives back the original
+        rejoined = messages[0][:-len("\n```")]
+        for message in messages[1:-1]:
+            rejoined += "\n" + message[len("```py\n"):-len("\n```")]
+        rejoined += "\n" + messages[-1][len("```py\n"):]
+        self.assertEqual(rejoined, content)
+
+    def test_closed_code_block_not_reopened(self):
+        content = "```\ncode\n```\n" + "\n".join(sample_lines(1000))
+        messages = list(utils.split_messages(content))
+        for message in messages[1:]:
+            self.assertFalse(message.startswith("```"))
+        self.assertEqual("\n".join(messages), content)
+
+    def test_accepts_iterable_of_lines(self):
+        lines = sample_lines(2000)
+        self.assertEqual("\n".join(utils.split_messages(iter(lines))), "\n".join(lines))
+
+    def test_inline_fence_reopened_without_leading_text(self):
+        code = [f"line {i} = {'v' * 40}" for i in range(200)]
+        content = "Report: ```py\n" + "\n".join(code) + "\n```"
+        messages = list(utils.split_messages(content))
+        self.assertGreater(len(messages), 1)
+        for message in messages[1:]:
+            self.assertTrue(message.startswith("```py\n"))
+            self.assertNotIn("Report:", message)
+
+    def test_long_fenced_line_without_spaces(self):
+        content = "```" + "x" * 2500 + "\nfoo\n```"
+        messages = list(utils.split_messages(content))
+        self.assertLess(len(messages), 5)
+        for message in messages:
+            self.assertLessEqual(len(message), CONTENT_LIMIT)
+            self.assertEqual(message.count("```") % 2, 0)
+        self.assertTrue(messages[1].startswith("```\n"))
+
+    def test_long_fenced_line_of_words(self):
+        content = "```" + " ".join(["word"] * 600)
+        messages = list(utils.split_messages(content))
+        self.assertLess(len(messages), 5)
+        for message in messages:
+            self.assertLessEqual(len(message), CONTENT_LIMIT)
+        self.assertTrue(messages[1].startswith("```\n"))
+
+    def test_long_message_in_code_block(self):
+        # As sent back to authors of deleted messages in picture-only channels
+        content = "Pictures only!\nYour message: ```" + "x" * 5000 + "```"
+        messages = list(utils.split_messages(content))
+        self.assertLess(len(messages), 6)
+        for message in messages:
+            self.assertLessEqual(len(message), CONTENT_LIMIT)
+        self.assertEqual("".join(m.replace("```", "").replace("\n", "") for m in messages[1:]).count("x")
+                         + messages[0].count("x"), 5000)
+
+
+class TokenBucketTests(unittest.TestCase):
+    """Tests for `utils.TokenBucket`."""
+
+    def setUp(self):
+        utils.TokenBucket._routes.pop("test_route", None)
+        self.addCleanup(utils.TokenBucket._routes.pop, "test_route", None)
+
+    def test_route_bucket_shared(self):
+        bucket = utils.TokenBucket.for_route("test_route", 5, 1)
+        self.assertIs(utils.TokenBucket.for_route("test_route", 5, 1), bucket)
+
+    def test_route_bucket_takes_new_limits(self):
+        bucket = utils.TokenBucket.for_route("test_route", 5, 1)
+        bucket.pause(30)
+        updated = utils.TokenBucket.for_route("test_route", 2, 10)
+
+        self.assertIs(updated, bucket)
+        self.assertEqual((updated.uses, updated.per_seconds), (2, 10))
+        self.assertGreater(updated._paused_until, 0)